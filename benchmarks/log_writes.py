@@ -0,0 +1,169 @@
+"""
+Measures how many bytes the database sends back for the log writes of a thread.
+
+The old write path (`find_one_and_update` returning the whole log, on every
+message and on close) is compared with the current one (`bulk_write` for the
+messages, `LOG_SUMMARY_PROJECTION` on close). The size of every reply is taken
+from the driver's command monitoring, for threads of increasing length.
+
+Run it against a MongoDB you can write to, the `modmail_benchmark` database is
+created and dropped::
+
+    python -m benchmarks.log_writes --mongo-uri mongodb://localhost:27017
+"""
+
+import argparse
+import os
+import secrets
+from datetime import datetime
+
+from bson import BSON
+from pymongo import MongoClient, ReturnDocument, UpdateOne, monitoring
+
+from core.clients import LOG_SUMMARY_PROJECTION
+
+DATABASE = "modmail_benchmark"
+
+# what post_log sets when a thread is closed
+CLOSE = {"$set": {"open": False, "closed_at": datetime.utcnow(), "close_message": None}}
+
+
+class ReplySizes(monitoring.CommandListener):
+    """Adds up the size of the replies the driver receives."""
+
+    def __init__(self):
+        self.bytes = 0
+        self.commands = 0
+
+    def reset(self) -> None:
+        self.bytes = 0
+        self.commands = 0
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        self.bytes += len(BSON.encode(event.reply))
+        self.commands += 1
+
+    def failed(self, event) -> None:
+        pass
+
+
+def make_message(i: int, content_size: int) -> dict:
+    """A message like the ones `ApiClient.append_log` writes."""
+    return {
+        "timestamp": datetime.utcnow(),
+        "message_id": str(10**17 + i),
+        "author": {
+            "id": str(10**17 + i % 2),
+            "name": "benchmark",
+            "discriminator": "0001",
+            "avatar_url": "https://cdn.discordapp.com/embed/avatars/0.png",
+            "mod": bool(i % 2),
+        },
+        "content": "x" * content_size,
+        "type": "thread_message",
+        "attachments": [],
+    }
+
+
+def new_log(logs, channel_id: str) -> None:
+    key = secrets.token_hex(6)
+    logs.insert_one(
+        {
+            "_id": key,
+            "key": key,
+            "open": True,
+            "created_at": datetime.utcnow(),
+            "closed_at": None,
+            "channel_id": channel_id,
+            "messages": [],
+        }
+    )
+
+
+def run(logs, listener: ReplySizes, length: int, content_size: int) -> list:
+    """Writes two threads of `length` messages, the old way and the current way."""
+    rows = []
+
+    new_log(logs, "old")
+    listener.reset()
+    for i in range(length):
+        logs.find_one_and_update(
+            {"channel_id": "old"},
+            {"$push": {"messages": make_message(i, content_size)}},
+            return_document=ReturnDocument.AFTER,
+        )
+    rows.append(("append (find_one_and_update)", length, listener.commands, listener.bytes))
+    listener.reset()
+    logs.find_one_and_update({"channel_id": "old"}, CLOSE, return_document=ReturnDocument.AFTER)
+    rows.append(("close (whole log)", length, listener.commands, listener.bytes))
+
+    new_log(logs, "new")
+    listener.reset()
+    for i in range(length):
+        # a batch of one message, the most the log worker ever sends per message
+        logs.bulk_write(
+            [
+                UpdateOne(
+                    {"channel_id": "new"},
+                    {"$push": {"messages": {"$each": [make_message(i, content_size)]}}},
+                )
+            ],
+            ordered=False,
+        )
+    rows.append(("append (bulk_write)", length, listener.commands, listener.bytes))
+    listener.reset()
+    logs.find_one_and_update(
+        {"channel_id": "new"},
+        CLOSE,
+        projection=LOG_SUMMARY_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+    rows.append(("close (LOG_SUMMARY_PROJECTION)", length, listener.commands, listener.bytes))
+
+    logs.delete_many({})
+    return rows
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(
+        prog="python -m benchmarks.log_writes",
+        description="Misura i byte ricevuti dal database per le scritture dei log.",
+    )
+    argparser.add_argument(
+        "--mongo-uri", default=os.getenv("MONGO_URI"), help="default: MONGO_URI"
+    )
+    argparser.add_argument(
+        "--lengths",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000],
+        help="il numero di messaggi dei thread",
+    )
+    argparser.add_argument(
+        "--content-size", type=int, default=200, help="i caratteri di ogni messaggio"
+    )
+    args = argparser.parse_args()
+    if args.mongo_uri is None:
+        argparser.error("MONGO_URI (o --mongo-uri) è necessario.")
+
+    listener = ReplySizes()
+    client = MongoClient(args.mongo_uri, event_listeners=[listener])
+    try:
+        logs = client[DATABASE].logs
+        logs.create_index("channel_id")
+        print(
+            f"{'operazione':<32} {'messaggi':>8} {'comandi':>8} {'byte':>12} {'byte/comando':>13}"
+        )
+        for length in args.lengths:
+            for name, messages, commands, size in run(logs, listener, length, args.content_size):
+                print(f"{name:<32} {messages:>8} {commands:>8} {size:>12} {size // commands:>13}")
+    finally:
+        client.drop_database(DATABASE)
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
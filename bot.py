@@ -4,10 +4,9 @@ __version__ = "1.0.1"
 import asyncio
 import logging
 import os
-import re
 import sys
 import typing
-from datetime import datetime
+from datetime import datetime, timedelta
 from types import SimpleNamespace
 
 import discord
@@ -32,16 +31,27 @@ except ImportError:
     pass
 
 from core import checks
+from core.blocklist import BlockList
 from core.clients import ApiClient, PluginDatabaseClient
 from core.config import ConfigManager
-from core.utils import human_join, normalize_alias
+from core.indexes import ensure_indexes
+from core.utils import human_join, normalize_alias, parse_timestamp
 from core.models import PermissionLevel, SafeFormatter, getLogger, configure_logging
+from core.scheduler import Scheduler
+from core.search import SearchIndex
+from core.stats import day_start
 from core.thread import ThreadManager
 from core.time import human_timedelta
 
 
 logger = getLogger(__name__)
 
+# how often the old closed logs are archived
+LOG_ARCHIVE_INTERVAL = timedelta(hours=6)
+
+# how long after midnight (UTC) the logs of the previous day are rolled up
+LOG_ROLLUP_DELAY = timedelta(minutes=5)
+
 temp_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "temp")
 if not os.path.exists(temp_dir):
     os.mkdir(temp_dir)
@@ -56,13 +66,19 @@ class VincyBot07(commands.Bot):
         self.formatter = SafeFormatter()
         self.loaded_cogs = ["cogs.modmail", "cogs.plugin", "cogs.utilita"]
         self._connected = asyncio.Event()
+        self._metrics_backfilled = asyncio.Event()
         self.start_time = datetime.utcnow()
 
         self.config = ConfigManager(self)
         self.config.populate_cache()
 
+        self.scheduler = Scheduler(self)
         self.threads = ThreadManager(self)
+        self.blocklist = BlockList(self)
+        self.scheduler.register("archive_logs", self.archive_logs)
+        self.scheduler.register("rollup_logs", self.rollup_logs)
 
+        self.temp_dir = temp_dir
         self.log_file_name = os.path.join(temp_dir, f"{self.token.split('.')[0]}.log")
         self._configure_logging()
 
@@ -81,6 +97,11 @@ class VincyBot07(commands.Bot):
             logger.critical(e)
             sys.exit(0)
 
+        self.search_index = None
+        if self.config.get("log_search_index"):
+            path = self.config["log_search_index_path"] or os.path.join(temp_dir, "search.sqlite3")
+            self.search_index = SearchIndex(path)
+
         self.plugin_db = PluginDatabaseClient(self)
         self.startup()
 
@@ -172,6 +193,15 @@ class VincyBot07(commands.Bot):
             logger.critical("Errore fatale", exc_info=True)
         finally:
             self.loop.run_until_complete(self.logout())
+            try:
+                self.loop.run_until_complete(self.api.drain_logs())
+            except Exception:
+                logger.error("Non è stato possibile salvare i log in coda.", exc_info=True)
+            if self.config.ready_event.is_set():
+                try:
+                    self.loop.run_until_complete(self.config.flush())
+                except Exception:
+                    logger.error("Non è stato possibile salvare la configurazione.", exc_info=True)
             for task in asyncio.all_tasks(self.loop):
                 task.cancel()
             try:
@@ -180,6 +210,8 @@ class VincyBot07(commands.Bot):
                 logger.debug("Tutte le attività in sospeso sono state annullate.")
             finally:
                 self.loop.run_until_complete(self.session.close())
+                if self.search_index is not None:
+                    self.search_index.close()
                 logger.error(" - Spegnimento del bot - ")
 
     @property
@@ -322,7 +354,8 @@ class VincyBot07(commands.Bot):
 
     @property
     def blocked_users(self) -> typing.Dict[str, str]:
-        return self.config["blocked"]
+        """A read-only snapshot of the blocked users, use `blocklist` to make changes."""
+        return {str(e["user_id"]): self.blocklist.format_reason(e) for e in self.blocklist}
 
     @property
     def blocked_whitelisted_users(self) -> typing.List[str]:
@@ -386,30 +419,63 @@ class VincyBot07(commands.Bot):
 
         logger.debug("Connesso al gateway.")
         await self.config.refresh()
-        await self.setup_indexes()
+        self.loop.create_task(self.setup_indexes())
+        await self.scheduler.load()
+        await self.blocklist.load()
+        await self.threads.load_states()
         self._connected.set()
 
     async def setup_indexes(self):
-        """Setup text indexes so we can use the $search operator"""
-        coll = self.db.logs
-        index_name = "messages.content_text_messages.author.name_text_key_text"
-
-        index_info = await coll.index_information()
-
-        # Backwards compatibility
-        old_index = "messages.content_text_messages.author.name_text"
-        if old_index in index_info:
-            logger.info("Dropping old index: %s", old_index)
-            await coll.drop_index(old_index)
-
-        if index_name not in index_info:
-            logger.info('Creating "text" index for logs collection.')
-            logger.info("Name: %s", index_name)
-            await coll.create_index(
-                [("messages.content", "text"), ("messages.author.name", "text"), ("key", "text")]
-            )
+        """Creates the indexes declared in core.indexes, in the background."""
+        try:
+            await ensure_indexes(self.db)
+        except Exception:
+            logger.error("Non è stato possibile configurare gli index database.", exc_info=True)
+            return
         logger.debug("Gli index database sono stati configurati e verificati con successo.")
 
+    async def archive_logs(self, job=None):
+        """Moves the old closed logs into the archive, then runs again after a while."""
+        older_than = self.config.get("log_archive_after")
+        if older_than == isodate.Duration():
+            return
+
+        retention = self.config.get("log_retention")
+        if retention == isodate.Duration():
+            retention = None
+        else:
+            retention = timedelta(seconds=retention.total_seconds())
+
+        try:
+            await self.api.archive_closed_logs(
+                timedelta(seconds=older_than.total_seconds()), retention
+            )
+        finally:
+            # a failed run is retried with the next one
+            await self.scheduler.schedule(
+                "archive_logs", "archive_logs", datetime.utcnow() + LOG_ARCHIVE_INTERVAL
+            )
+
+    async def backfill_metrics(self):
+        """Fills the metrics of the old logs, the rollups wait for it to finish."""
+        try:
+            await self.api.backfill_metrics()
+        finally:
+            self._metrics_backfilled.set()
+
+    async def rollup_logs(self, job=None):
+        """Rolls up the logs of the days that are over, then runs again the next day."""
+        # a day is never rolled up again, so its logs need their metrics first
+        await self._metrics_backfilled.wait()
+        try:
+            await self.api.rollup_closed_logs()
+        finally:
+            # the days that failed are rolled up with the next run
+            tomorrow = day_start(datetime.utcnow()) + timedelta(days=1)
+            await self.scheduler.schedule(
+                "rollup_logs", "rollup_logs", tomorrow + LOG_ROLLUP_DELAY
+            )
+
     async def on_ready(self):
         """L'avvio del bot."""
         # commands.Bot.remove_command(self, name="help")
@@ -437,49 +503,41 @@ class VincyBot07(commands.Bot):
 
         await self.threads.populate_cache()
 
-        # closures
-        closures = self.config["closures"]
-        logger.info("Ci sono %d stanze che stanno per essere chiuse.", len(closures))
+        self.scheduler.start()
+        logger.info("Ci sono %d operazioni programmate.", len(self.scheduler))
         logger.line()
 
-        for recipient_id, items in tuple(closures.items()):
-            after = (datetime.fromisoformat(items["time"]) - datetime.utcnow()).total_seconds()
-            if after <= 0:
-                logger.debug("Sto chiudendo la stanza per l'utente %s.", recipient_id)
-                after = 0
-            else:
-                logger.debug(
-                    "La stanza dell'utente %s verrà chiusa tra %s secondi.", recipient_id, after
-                )
-
-            thread = await self.threads.find(recipient_id=int(recipient_id))
-
-            if not thread:
-                # If the channel is deleted
-                logger.debug(
-                    "Non è stato possibile chiudere la stanza per l'utente %s.", recipient_id
-                )
-                self.config["closures"].pop(recipient_id)
+        if self.config.get("log_message_buckets"):
+            self.loop.create_task(self.api.bucket_closed_logs())
+        self.loop.create_task(self.api.backfill_responders())
+        self.loop.create_task(self.backfill_metrics())
+        self.loop.create_task(self.api.migrate_log_dates())
+        if self.search_index is not None:
+            if self.config["log_search_index_stale"]:
+                # the logs closed while the index was disabled are missing from it
+                await self.search_index.set_state("backfill", "")
+                self.config["log_search_index_stale"] = False
                 await self.config.update()
-                continue
-
-            await thread.close(
-                closer=self.get_user(items["closer_id"]),
-                after=after,
-                silent=items["silent"],
-                delete_channel=items["delete_channel"],
-                message=items["message"],
-                auto_close=items.get("auto_close", False),
-            )
+            self.loop.create_task(self.api.index_logs())
+        elif not self.config["log_search_index_stale"]:
+            self.config["log_search_index_stale"] = True
+            await self.config.update()
+        archiving = self.config.get("log_archive_after") != isodate.Duration()
+        if archiving and self.scheduler.get("archive_logs") is None:
+            await self.scheduler.schedule("archive_logs", "archive_logs", datetime.utcnow())
+        if self.scheduler.get("rollup_logs") is None:
+            await self.scheduler.schedule("rollup_logs", "rollup_logs", datetime.utcnow())
 
         for log in await self.api.get_open_logs():
-            if self.get_channel(int(log["channel_id"])) is None:
+            if self.get_channel(int(log["channel_id"])) is not None:
+                self.loop.create_task(self.threads.backfill_message_links(log["channel_id"]))
+            else:
                 logger.debug("Unable to resolve thread with channel %s.", log["channel_id"])
                 log_data = await self.api.post_log(
                     log["channel_id"],
                     {
                         "open": False,
-                        "closed_at": str(datetime.utcnow()),
+                        "closed_at": datetime.utcnow(),
                         "close_message": "Channel has been deleted, no closer found.",
                         "closer": {
                             "id": str(self.user.id),
@@ -564,11 +622,11 @@ class VincyBot07(commands.Bot):
                 "L'utente %s è stato bloccato per via dell'età del suo account.", author.name
             )
 
-            if str(author.id) not in self.blocked_users:
+            if author.id not in self.blocklist:
                 new_reason = (
                     f"Messaggio di sistema: Account nuovo. È richiesto aspettare per {delta}."
                 )
-                self.blocked_users[str(author.id)] = new_reason
+                self.blocklist.add_system(author.id, new_reason)
 
             return False
         return True
@@ -592,45 +650,30 @@ class VincyBot07(commands.Bot):
             delta = human_timedelta(min_guild_age)
             logger.debug("L'utente %s è stato bloccato per via dell'eta dell'account", author.name)
 
-            if str(author.id) not in self.blocked_users:
+            if author.id not in self.blocklist:
                 new_reason = (
                     f"Messaggio di sistema: Entrato di recende. È richiesto aspettare per {delta}."
                 )
-                self.blocked_users[str(author.id)] = new_reason
+                self.blocklist.add_system(author.id, new_reason)
 
             return False
         return True
 
     def check_manual_blocked(self, author: discord.Member) -> bool:
-        if str(author.id) not in self.blocked_users:
+        entry = self.blocklist.get(author.id)
+        if entry is None:
             return True
 
-        blocked_reason = self.blocked_users.get(str(author.id)) or ""
-        now = datetime.utcnow()
-
-        if blocked_reason.startswith("System Message:"):
+        if entry["system"]:
             # Met the limits already, otherwise it would've been caught by the previous checks
             logger.debug("No longer internally blocked, user %s.", author.name)
-            self.blocked_users.pop(str(author.id))
+            self.loop.create_task(self.blocklist.remove(author.id))
             return True
-        # etc "blah blah blah... until 2019-10-14T21:12:45.559948."
-        end_time = re.search(r"until ([^`]+?)\.$", blocked_reason)
-        if end_time is None:
-            # backwards compat
-            end_time = re.search(r"%([^%]+?)%", blocked_reason)
-            if end_time is not None:
-                logger.warning(
-                    r"Deprecated time message for user %s, block and unblock again to update.",
-                    author.name,
-                )
 
-        if end_time is not None:
-            after = (datetime.fromisoformat(end_time.group(1)) - now).total_seconds()
-            if after <= 0:
-                # No longer blocked
-                self.blocked_users.pop(str(author.id))
-                logger.debug("L'utente %s non è più bloccato.", author.name)
-                return True
+        if self.blocklist.is_expired(entry):
+            # Removed from the blocklist as soon as it expires
+            logger.debug("L'utente %s non è più bloccato.", author.name)
+            return True
         logger.debug("L'utente %s è stato bloccato.", author.name)
         return False
 
@@ -655,32 +698,27 @@ class VincyBot07(commands.Bot):
         else:
             author = member
 
+        # Evaluated in memory, the blocklist is only saved when an entry changes.
         if str(author.id) in self.blocked_whitelisted_users:
-            if str(author.id) in self.blocked_users:
-                self.blocked_users.pop(str(author.id))
-                await self.config.update()
+            if author.id in self.blocklist:
+                await self.blocklist.remove(author.id)
             return False
 
-        blocked_reason = self.blocked_users.get(str(author.id)) or ""
+        entry = self.blocklist.get(author.id)
 
         if not self.check_account_age(author) or not self.check_guild_age(author):
-            new_reason = self.blocked_users.get(str(author.id))
-            if new_reason != blocked_reason:
-                if send_message:
-                    await channel.send(
-                        embed=discord.Embed(
-                            title="Messaggio non inviato!",
-                            description=new_reason,
-                            color=self.error_color,
-                        )
+            new_entry = self.blocklist.get(author.id)
+            if new_entry is not entry and send_message:
+                await channel.send(
+                    embed=discord.Embed(
+                        title="Messaggio non inviato!",
+                        description=new_entry["reason"],
+                        color=self.error_color,
                     )
+                )
             return True
 
-        if not self.check_manual_blocked(author):
-            return True
-
-        await self.config.update()
-        return False
+        return not self.check_manual_blocked(author)
 
     async def get_thread_cooldown(self, author: discord.Member):
         thread_cooldown = self.config.get("thread_cooldown")
@@ -702,12 +740,10 @@ class VincyBot07(commands.Bot):
             return
 
         try:
-            cooldown = datetime.fromisoformat(last_log_closed_at) + thread_cooldown
+            cooldown = parse_timestamp(last_log_closed_at) + thread_cooldown
         except ValueError:
             logger.warning("Errore con la configurazione 'thread_cooldown'.", exc_info=True)
-            cooldown = datetime.fromisoformat(last_log_closed_at) + self.config.remove(
-                "thread_cooldown"
-            )
+            cooldown = parse_timestamp(last_log_closed_at) + self.config.remove("thread_cooldown")
 
         if cooldown > now:
             # User messaged before thread cooldown ended
@@ -1033,10 +1069,23 @@ class VincyBot07(commands.Bot):
     async def on_raw_reaction_remove(self, payload):
         await self.handle_reaction_events(payload, add=False)
 
+    async def on_guild_channel_create(self, channel):
+        if channel.guild != self.modmail_guild or not isinstance(channel, discord.TextChannel):
+            return
+        self.threads.channel_created(channel)
+
+    async def on_guild_channel_update(self, before, after):
+        if after.guild != self.modmail_guild or not isinstance(after, discord.TextChannel):
+            return
+        await self.threads.channel_updated(before, after)
+
     async def on_guild_channel_delete(self, channel):
         if channel.guild != self.modmail_guild:
             return
 
+        if isinstance(channel, discord.TextChannel):
+            self.threads.channel_deleted(channel)
+
         try:
             audit_logs = self.modmail_guild.audit_logs()
             entry = await audit_logs.find(lambda a: a.target == channel)
@@ -1101,7 +1150,7 @@ class VincyBot07(commands.Bot):
             try:
                 message = await thread.find_linked_message_from_dm(message)
             except ValueError as e:
-                if str(e) != "Thread channel message not found.":
+                if str(e) != "Il messaggio del canale della stanza non è stato trovato.":
                     logger.warning("Failed to find linked message to delete: %s", e)
                 return
             embed = message.embeds[0]
@@ -1115,7 +1164,10 @@ class VincyBot07(commands.Bot):
         try:
             await thread.delete_message(message, note=False)
         except ValueError as e:
-            if str(e) not in {"DM message not found.", "Malformed thread message."}:
+            if str(e) not in {
+                "Messaggio privato non trovato.",
+                "Messaggio della stanza non valido.",
+            }:
                 logger.warning("Failed to find linked message to delete: %s", e)
             return
         except discord.NotFound:
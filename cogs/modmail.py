@@ -1,20 +1,30 @@
 import asyncio
+import hashlib
+import io
+import os
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 from itertools import zip_longest
 from typing import Optional, Union
 from types import SimpleNamespace
 
 import discord
 from discord.ext import commands
-from discord.utils import escape_markdown
 
 from dateutil import parser
 from natural.date import duration
 
 from core import checks
 from core.models import PermissionLevel, getLogger
-from core.paginator import EmbedPaginatorSession
+from core.clients import LOG_ENTRY_PROJECTION
+from core.export import EXPORT_FORMATS, LogExporter, export_format, export_query
+from core.paginator import (
+    CursorPageSource,
+    EmbedPaginatorSession,
+    LazyEmbedPaginatorSession,
+    SearchPageSource,
+)
+from core.stats import STATS_PERCENTILES, StatsReport, day_start
 from core.thread import Thread
 from core.time import UserFriendlyTime, human_timedelta
 from core.utils import *
@@ -422,19 +432,12 @@ class Modmail(commands.Cog):
 
         thread = ctx.thread
 
-        if str(thread.id) not in self.bot.config["notification_squad"]:
-            self.bot.config["notification_squad"][str(thread.id)] = []
-
-        mentions = self.bot.config["notification_squad"][str(thread.id)]
-
-        if mention in mentions:
+        if not await self.bot.threads.add_mention(thread.id, "notification_squad", mention):
             embed = discord.Embed(
                 color=self.bot.error_color,
                 description=f"{mention} e' gia' pronto per essere menzionato.",
             )
         else:
-            mentions.append(mention)
-            await self.bot.config.update()
             embed = discord.Embed(
                 color=self.bot.main_color,
                 description=f"{mention} verra' menzionato al prossimo messaggio ricevuto.",
@@ -460,19 +463,12 @@ class Modmail(commands.Cog):
 
         thread = ctx.thread
 
-        if str(thread.id) not in self.bot.config["notification_squad"]:
-            self.bot.config["notification_squad"][str(thread.id)] = []
-
-        mentions = self.bot.config["notification_squad"][str(thread.id)]
-
-        if mention not in mentions:
+        if not await self.bot.threads.remove_mention(thread.id, "notification_squad", mention):
             embed = discord.Embed(
                 color=self.bot.error_color,
                 description=f"{mention} non ha una notifica in attesa.",
             )
         else:
-            mentions.remove(mention)
-            await self.bot.config.update()
             embed = discord.Embed(
                 color=self.bot.main_color, description=f"{mention} non sara' piu' notificato."
             )
@@ -499,19 +495,12 @@ class Modmail(commands.Cog):
 
         thread = ctx.thread
 
-        if str(thread.id) not in self.bot.config["subscriptions"]:
-            self.bot.config["subscriptions"][str(thread.id)] = []
-
-        mentions = self.bot.config["subscriptions"][str(thread.id)]
-
-        if mention in mentions:
+        if not await self.bot.threads.add_mention(thread.id, "subscriptions", mention):
             embed = discord.Embed(
                 color=self.bot.error_color,
                 description=f"{mention} si e' gia' iscritto a questo thread.",
             )
         else:
-            mentions.append(mention)
-            await self.bot.config.update()
             embed = discord.Embed(
                 color=self.bot.main_color,
                 description=f"{mention} verra' notificato di ogni messaggio nel thread.",
@@ -537,19 +526,12 @@ class Modmail(commands.Cog):
 
         thread = ctx.thread
 
-        if str(thread.id) not in self.bot.config["subscriptions"]:
-            self.bot.config["subscriptions"][str(thread.id)] = []
-
-        mentions = self.bot.config["subscriptions"][str(thread.id)]
-
-        if mention not in mentions:
+        if not await self.bot.threads.remove_mention(thread.id, "subscriptions", mention):
             embed = discord.Embed(
                 color=self.bot.error_color,
                 description=f"{mention} non si e' gia' iscritto a questo thread.",
             )
         else:
-            mentions.remove(mention)
-            await self.bot.config.update()
             embed = discord.Embed(
                 color=self.bot.main_color,
                 description=f"{mention} si e' ora disiscritto da questo thread.",
@@ -583,47 +565,99 @@ class Modmail(commands.Cog):
         await ctx.send(embed=discord.Embed(color=self.bot.main_color, description=log_link))
 
     def format_log_embeds(self, logs, avatar_url):
-        embeds = []
         logs = tuple(logs)
-        title = f"Risultati in totale trovati ({len(logs)})"
-
-        for entry in logs:
-            created_at = parser.parse(entry["created_at"])
-
-            prefix = self.bot.config["log_url_prefix"].strip("/")
-            if prefix == "NONE":
-                prefix = ""
-            log_url = f"{self.bot.config['log_url'].strip('/')}{'/' + prefix if prefix else ''}/{entry['key']}"
-
-            username = entry["recipient"]["name"] + "#"
-            username += entry["recipient"]["discriminator"]
-
-            embed = discord.Embed(color=self.bot.main_color, timestamp=created_at)
-            embed.set_author(name=f"{title} - {username}", icon_url=avatar_url, url=log_url)
-            embed.url = log_url
-            embed.add_field(name="Creato", value=duration(created_at, now=datetime.utcnow()))
-            closer = entry.get("closer")
-            if closer is None:
-                closer_msg = "Sconosciuto"
-            else:
-                closer_msg = f"<@{closer['id']}>"
-            embed.add_field(name="Chiuso da", value=closer_msg)
+        return [self.format_log_embed(entry, len(logs), avatar_url) for entry in logs]
+
+    def format_log_embed(self, entry, total, avatar_url):
+        title = f"Risultati in totale trovati ({total})"
+
+        created_at = parse_timestamp(entry["created_at"])
+
+        prefix = self.bot.config["log_url_prefix"].strip("/")
+        if prefix == "NONE":
+            prefix = ""
+        log_url = f"{self.bot.config['log_url'].strip('/')}{'/' + prefix if prefix else ''}/{entry['key']}"
+
+        username = entry["recipient"]["name"] + "#"
+        username += entry["recipient"]["discriminator"]
+
+        embed = discord.Embed(color=self.bot.main_color, timestamp=created_at)
+        embed.set_author(name=f"{title} - {username}", icon_url=avatar_url, url=log_url)
+        embed.url = log_url
+        embed.add_field(name="Creato", value=duration(created_at, now=datetime.utcnow()))
+        closer = entry.get("closer")
+        if closer is None:
+            closer_msg = "Sconosciuto"
+        else:
+            closer_msg = f"<@{closer['id']}>"
+        embed.add_field(name="Chiuso da", value=closer_msg)
+
+        if entry["recipient"]["id"] != entry["creator"]["id"]:
+            embed.add_field(name="Creato da", value=f"<@{entry['creator']['id']}>")
 
-            if entry["recipient"]["id"] != entry["creator"]["id"]:
-                embed.add_field(name="Creato da", value=f"<@{entry['creator']['id']}>")
+        embed.add_field(name="Preview", value=format_preview(entry["messages"]), inline=False)
 
-            embed.add_field(name="Preview", value=format_preview(entry["messages"]), inline=False)
+        if closer is not None:
+            # BUG: Currently, logviewer can't display logs without a closer.
+            embed.add_field(name="Link", value=log_url)
+        else:
+            logger.debug("Ingresso log errato: nessun chiudente.")
+            embed.add_field(name="Chiave Log", value=f"`{entry['key']}`")
+
+        embed.set_footer(text="ID recipiente: " + str(entry["recipient"]["id"]))
+        return embed
+
+    def format_search_page(self, query, results, total):
+        prefix = self.bot.config["log_url_prefix"].strip("/")
+        if prefix == "NONE":
+            prefix = ""
+        base_url = f"{self.bot.config['log_url'].strip('/')}{'/' + prefix if prefix else ''}"
 
-            if closer is not None:
-                # BUG: Currently, logviewer can't display logs without a closer.
-                embed.add_field(name="Link", value=log_url)
+        embed = discord.Embed(
+            color=self.bot.main_color,
+            title=f"Risultati per {truncate(query, max=50)} ({total})",
+        )
+        for result in results:
+            if result["key"] is not None:
+                link = f"[`{result['key']}`]({base_url}/{result['key']})"
             else:
-                logger.debug("Ingresso log errato: nessun chiudente.")
-                embed.add_field(name="Chiave Log", value=f"`{entry['key']}`")
+                link = "Log sconosciuto"
+            embed.add_field(
+                name=f"{result['author']} • {result['timestamp'][:16]}",
+                value=f"{result['snippet']}\n{link}",
+                inline=False,
+            )
+        return embed
 
-            embed.set_footer(text="ID recipiente: " + str(entry["recipient"]["id"]))
-            embeds.append(embed)
-        return embeds
+    async def send_log_embeds(
+        self, ctx, query, avatar_url, not_found, *, limit=None, archived=True, newest_first=True
+    ):
+        """
+        Pages through the logs matching `query`, loading them as they are shown.
+
+        The archived logs come after the others, unless `archived` is `False`.
+        The logs are sorted from the last closed one, which needs an index
+        ending with `closed_at`, unless `newest_first` is `False`.
+        """
+        collections = [self.bot.api.logs]
+        if archived:
+            collections.append(self.bot.api.log_archive)
+
+        source = CursorPageSource(
+            collections,
+            query,
+            lambda entry, total: self.format_log_embed(entry, total, avatar_url),
+            projection=LOG_ENTRY_PROJECTION,
+            sort=[("closed_at", -1)] if newest_first else None,
+            limit=limit,
+        )
+
+        if not await source.count():
+            embed = discord.Embed(color=self.bot.error_color, description=not_found)
+            return await ctx.send(embed=embed)
+
+        session = LazyEmbedPaginatorSession(ctx, source)
+        await session.run()
 
     @commands.group(invoke_without_command=True)
     @checks.has_permissions(PermissionLevel.SUPPORTER)
@@ -647,21 +681,12 @@ class Modmail(commands.Cog):
         default_avatar = "https://cdn.discordapp.com/embed/avatars/0.png"
         icon_url = getattr(user, "avatar_url", default_avatar)
 
-        logs = await self.bot.api.get_user_logs(user.id)
-
-        if not any(not log["open"] for log in logs):
-            embed = discord.Embed(
-                color=self.bot.error_color,
-                description="Questo utente non ha nessun log precedente.",
-            )
-            return await ctx.send(embed=embed)
-
-        logs = reversed([log for log in logs if not log["open"]])
-
-        embeds = self.format_log_embeds(logs, avatar_url=icon_url)
-
-        session = EmbedPaginatorSession(ctx, *embeds)
-        await session.run()
+        await self.send_log_embeds(
+            ctx,
+            self.bot.api.user_logs_query(user.id),
+            icon_url,
+            "Questo utente non ha nessun log precedente.",
+        )
 
     @logs.command(name="closed-by", aliases=["closeby"])
     @checks.has_permissions(PermissionLevel.SUPPORTER)
@@ -676,21 +701,12 @@ class Modmail(commands.Cog):
 
         query = {"guild_id": str(self.bot.guild_id), "open": False, "closer.id": str(user.id)}
 
-        projection = {"messages": {"$slice": 5}}
-
-        entries = await self.bot.db.logs.find(query, projection).to_list(None)
-
-        embeds = self.format_log_embeds(entries, avatar_url=self.bot.guild.icon_url)
-
-        if not embeds:
-            embed = discord.Embed(
-                color=self.bot.error_color,
-                description="Nessun ingresso log e' stato trovato per quella ricerca.",
-            )
-            return await ctx.send(embed=embed)
-
-        session = EmbedPaginatorSession(ctx, *embeds)
-        await session.run()
+        await self.send_log_embeds(
+            ctx,
+            query,
+            self.bot.guild.icon_url,
+            "Nessun ingresso log e' stato trovato per quella ricerca.",
+        )
 
     @logs.command(name="delete", aliases=["wipe"])
     @checks.has_permissions(PermissionLevel.OWNER)
@@ -717,6 +733,77 @@ class Modmail(commands.Cog):
 
         await ctx.send(embed=embed)
 
+    @logs.command(name="export")
+    @checks.has_permissions(PermissionLevel.OWNER)
+    async def logs_export(self, ctx, fmt: str = "gzip", *filters):
+        """
+        Esporta i log in un file JSONL compresso.
+
+        `fmt` puo' essere `gzip` o `zstd` (se il pacchetto zstandard e' installato,
+        altrimenti viene usato `gzip`). I log possono essere filtrati con
+        `after=data`, `before=data`, `recipient=ID` e `closer=ID`.
+
+        Il file viene salvato nella cartella `temp/exports` del bot e inviato qui se non e' troppo grande.
+        Se l'esportazione viene interrotta, usa lo stesso comando per riprenderla.
+        Per esportare senza avviare il bot usa `python -m core.export`.
+        """
+        fmt = fmt.lower()
+        if fmt not in EXPORT_FORMATS:
+            raise commands.BadArgument(
+                f"Il formato deve essere uno tra {', '.join(EXPORT_FORMATS)}."
+            )
+        fmt = export_format(fmt)
+
+        options = {}
+        for option in filters:
+            name, _, value = option.partition("=")
+            name = name.lower()
+            try:
+                if name in {"after", "before"}:
+                    options[name] = parser.parse(value)
+                elif name in {"recipient", "closer"}:
+                    options[name + "_id"] = int(value.strip("<@!>"))
+                else:
+                    raise commands.BadArgument(f"Filtro sconosciuto: `{name}`.")
+            except (ValueError, OverflowError):
+                raise commands.BadArgument(f"Valore non valido per `{name}`: `{value}`.")
+
+        query = export_query(self.bot.guild_id, **options)
+        # the same export gets the same file, so running the command again resumes it
+        digest = hashlib.sha1(str(sorted(query.items())).encode()).hexdigest()[:10]
+        folder = os.path.join(self.bot.temp_dir, "exports")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"logs-{digest}{EXPORT_FORMATS[fmt]}")
+
+        if os.path.exists(path) and not os.path.exists(path + ".checkpoint"):
+            os.remove(path)
+
+        try:
+            exporter = LogExporter(self.bot.db, path, query, fmt)
+        except ValueError as e:
+            raise commands.BadArgument(str(e))
+
+        embed = discord.Embed(
+            color=self.bot.main_color, description="Esportazione dei log in corso..."
+        )
+        message = await ctx.send(embed=embed)
+        last_update = datetime.utcnow()
+
+        async def progress(exported):
+            nonlocal last_update
+            now = datetime.utcnow()
+            if (now - last_update).total_seconds() >= 5:
+                last_update = now
+                embed.description = f"Esportazione dei log in corso... ({exported} esportati)"
+                await message.edit(embed=embed)
+
+        exported = await exporter.run(progress)
+
+        embed.description = f"Esportati {exported} log in `temp/exports/{os.path.basename(path)}`."
+        await message.edit(embed=embed)
+        if os.path.getsize(path) <= 8 * 1024 * 1024:
+            await ctx.send(file=discord.File(path))
+
     @logs.command(name="responded")
     @checks.has_permissions(PermissionLevel.SUPPORTER)
     async def logs_responded(self, ctx, *, user: User = None):
@@ -728,19 +815,12 @@ class Modmail(commands.Cog):
         """
         user = user if user is not None else ctx.author
 
-        entries = await self.bot.api.get_responded_logs(user.id)
-
-        embeds = self.format_log_embeds(entries, avatar_url=self.bot.guild.icon_url)
-
-        if not embeds:
-            embed = discord.Embed(
-                color=self.bot.error_color,
-                description=f"{getattr(user, 'mention', user.id)} non ha risposto a nessun thread.",
-            )
-            return await ctx.send(embed=embed)
-
-        session = EmbedPaginatorSession(ctx, *embeds)
-        await session.run()
+        await self.send_log_embeds(
+            ctx,
+            self.bot.api.responded_logs_query(user.id),
+            self.bot.guild.icon_url,
+            f"{getattr(user, 'mention', user.id)} non ha risposto a nessun thread.",
+        )
 
     @logs.command(name="search", aliases=["find"])
     @checks.has_permissions(PermissionLevel.SUPPORTER)
@@ -749,31 +829,170 @@ class Modmail(commands.Cog):
         Trova tutti i log che contengono risultati con la tua query.
 
         Fornisci un `limit` per specificare il massimo numero di log che il bot deve trovare.
+
+        Se l'indice di ricerca (`LOG_SEARCH_INDEX`) e' attivo, vengono mostrati i messaggi trovati,
+        dal piu' pertinente. Usa le virgolette per cercare una frase e `*` alla fine di una parola
+        per cercare le parole che iniziano cosi', ad esempio `"non funziona" errore*`.
         """
 
         await ctx.trigger_typing()
 
-        query = {
-            "guild_id": str(self.bot.guild_id),
-            "open": False,
-            "$text": {"$search": f'"{query}"'},
-        }
+        if self.bot.search_index is not None:
+            source = SearchPageSource(
+                self.bot.search_index,
+                query,
+                lambda results, page, total: self.format_search_page(query, results, total),
+                limit=limit,
+            )
+            try:
+                found = await source.count()
+            except ValueError as e:
+                raise commands.BadArgument(str(e))
 
-        projection = {"messages": {"$slice": 5}}
+            if not found:
+                embed = discord.Embed(
+                    color=self.bot.error_color,
+                    description="Nessun messaggio e' stato trovato per quella ricerca.",
+                )
+                return await ctx.send(embed=embed)
+
+            session = LazyEmbedPaginatorSession(ctx, source)
+            return await session.run()
+
+        await self.send_log_embeds(
+            ctx,
+            await self.bot.api.search_logs_query(query),
+            self.bot.guild.icon_url,
+            "Nessun ingresso log e' stato trovato per quella ricerca.",
+            limit=limit,
+            archived=False,
+            # a $text query can't use another index to sort
+            newest_first=False,
+        )
+
+    async def get_stats_report(self, days: int) -> StatsReport:
+        if days < 0:
+            raise commands.BadArgument("Il numero di giorni non puo' essere negativo.")
+
+        # the rollups stop at the last day that is over
+        end = day_start(datetime.utcnow())
+        start = end - timedelta(days=days) if days else datetime.min
+        rollups = await self.bot.api.get_rollups(start, end)
+        if not days:
+            start = rollups[0]["date"] if rollups else end
+        return StatsReport(rollups, start, end)
 
-        entries = await self.bot.db.logs.find(query, projection).to_list(limit)
+    @commands.group(invoke_without_command=True)
+    @checks.has_permissions(PermissionLevel.SUPPORTER)
+    async def stats(self, ctx, days: int = 30):
+        """
+        Mostra le statistiche dei thread chiusi negli ultimi `days` giorni.
 
-        embeds = self.format_log_embeds(entries, avatar_url=self.bot.guild.icon_url)
+        Usa `0` come `days` per le statistiche di tutti i thread.
+        Le statistiche vengono aggiornate ogni giorno, quello di oggi non e' incluso.
+        """
+        await ctx.trigger_typing()
 
-        if not embeds:
+        report = await self.get_stats_report(days)
+        if not any(report.threads):
             embed = discord.Embed(
                 color=self.bot.error_color,
-                description="Nessun ingresso log e' stato trovato per quella ricerca.",
+                description="Nessun thread e' stato chiuso in questo periodo.",
             )
             return await ctx.send(embed=embed)
 
-        session = EmbedPaginatorSession(ctx, *embeds)
-        await session.run()
+        now = datetime.utcnow()
+
+        def format_seconds(seconds):
+            return human_timedelta(now + timedelta(seconds=float(seconds)), source=now)
+
+        def format_times(summary):
+            mean = summary.mean()
+            if mean is None:
+                return None
+            lines = [f"Media: {format_seconds(mean)}"]
+            lines += [
+                f"{p}%: {format_seconds(value)}"
+                for p, value in zip(STATS_PERCENTILES, summary.percentiles())
+            ]
+            return "\n".join(lines)
+
+        threads = int(sum(report.threads))
+        responded = int(sum(report.responded))
+        embed = discord.Embed(
+            title="Statistiche",
+            description=f"Thread chiusi dal {report.start:%d/%m/%Y} "
+            f"al {report.end - timedelta(days=1):%d/%m/%Y}.",
+            color=self.bot.main_color,
+        )
+        embed.add_field(
+            name="Thread chiusi", value=f"{threads} ({threads / report.days:.1f} al giorno)"
+        )
+        embed.add_field(name="Con risposta", value=f"{responded} ({responded / threads:.0%})")
+        open_threads = await self.bot.api.logs.count_documents(
+            {"guild_id": str(self.bot.guild_id), "open": True}
+        )
+        embed.add_field(name="Aperti ora", value=str(open_threads))
+
+        response_times = format_times(report.response_times)
+        if response_times is not None:
+            embed.add_field(name="Prima risposta", value=response_times)
+        durations = format_times(report.durations)
+        if durations is not None:
+            embed.add_field(name="Durata", value=durations)
+
+        trend = f"{report.trend:+.2f} thread al giorno"
+        change = report.weekly_change()
+        if change is not None:
+            trend += f"\n{change:+.0%} rispetto alla settimana prima"
+        embed.add_field(name="Andamento", value=trend)
+
+        names = {"user": "Utenti", "staff": "Staff", "internal": "Interni", "system": "Note"}
+        embed.add_field(
+            name="Messaggi",
+            value="\n".join(
+                f"{names.get(role, role)}: {int(sum(counts))}"
+                for role, counts in report.messages.items()
+                if any(counts)
+            )
+            or "Nessuno",
+        )
+
+        moderators = report.moderators + report.moderator_replies
+        if moderators:
+            embed.add_field(
+                name="Moderatori",
+                value="\n".join(
+                    f"<@{moderator_id}>: {report.moderators[moderator_id]} chiusi, "
+                    f"{report.moderator_replies[moderator_id]} con risposta"
+                    for moderator_id, _ in moderators.most_common(10)
+                ),
+                inline=False,
+            )
+
+        reasons = [
+            f"{truncate(reason, 40) if reason else 'Nessun messaggio'}: {count}"
+            for reason, count in report.close_reasons.most_common(5)
+        ]
+        if report.other_close_reasons:
+            reasons.append(f"Altri: {report.other_close_reasons}")
+        embed.add_field(name="Motivi di chiusura", value="\n".join(reasons), inline=False)
+
+        await ctx.send(embed=embed)
+
+    @stats.command(name="csv")
+    @checks.has_permissions(PermissionLevel.SUPPORTER)
+    async def stats_csv(self, ctx, days: int = 30):
+        """
+        Esporta le statistiche giornaliere degli ultimi `days` giorni in un file CSV.
+
+        Usa `0` come `days` per esportare tutti i giorni.
+        """
+        await ctx.trigger_typing()
+
+        report = await self.get_stats_report(days)
+        filename = f"stats-{report.start:%Y-%m-%d}-{report.end:%Y-%m-%d}.csv"
+        await ctx.send(file=discord.File(io.BytesIO(report.to_csv().encode()), filename=filename))
 
     @commands.command()
     @checks.has_permissions(PermissionLevel.SUPPORTER)
@@ -932,24 +1151,13 @@ class Modmail(commands.Cog):
             discord.Embed(title="Utenti bloccati", color=self.bot.main_color, description="")
         ]
 
-        users = []
+        entries = sorted(self.bot.blocklist, key=lambda e: e["created_at"])
 
-        for id_, reason in self.bot.blocked_users.items():
-            user = self.bot.get_user(int(id_))
-            if user:
-                users.append((user.mention, reason))
-            else:
-                try:
-                    user = await self.bot.fetch_user(id_)
-                    users.append((user.mention, reason))
-                except discord.NotFound:
-                    users.append((id_, reason))
-
-        if users:
+        if entries:
             embed = embeds[0]
 
-            for mention, reason in users:
-                line = mention + f" - {reason or 'Nessuna ragione specificata'}\n"
+            for entry in entries:
+                line = f"<@{entry['user_id']}> - {self.bot.blocklist.format_reason(entry)}\n"
                 if len(embed.description) + len(line) > 2048:
                     embed = discord.Embed(
                         title="Utenti bloccati (Continua)",
@@ -982,7 +1190,6 @@ class Modmail(commands.Cog):
                 return await ctx.send_help(ctx.command)
 
         mention = getattr(user, "mention", f"`{user.id}`")
-        msg = ""
 
         if str(user.id) in self.bot.blocked_whitelisted_users:
             embed = discord.Embed(
@@ -991,20 +1198,19 @@ class Modmail(commands.Cog):
                 color=self.bot.main_color,
             )
             self.bot.blocked_whitelisted_users.remove(str(user.id))
+            await self.bot.config.update()
             return await ctx.send(embed=embed)
 
         self.bot.blocked_whitelisted_users.append(str(user.id))
-
-        if str(user.id) in self.bot.blocked_users:
-            msg = self.bot.blocked_users.get(str(user.id)) or ""
-            self.bot.blocked_users.pop(str(user.id))
-
         await self.bot.config.update()
 
-        if msg.startswith("Messaggio di sistema: "):
+        entry = await self.bot.blocklist.remove(user.id)
+
+        if entry is not None and entry["system"]:
             # Se un utente viene bloccato internamente (per esempio: sotto eta' minima account)
             # Mostra un messaggio esteso col messaggio interno dentro
-            reason = msg[16:].strip().rstrip(".")
+            reason = self.bot.blocklist.format_reason(entry)
+            reason = reason[len("Messaggio di sistema:") :].strip().rstrip(".")
             embed = discord.Embed(
                 title="Successo",
                 description=f"{mention} era precedentemente bloccato internamente per "
@@ -1054,38 +1260,31 @@ class Modmail(commands.Cog):
             )
             return await ctx.send(embed=embed)
 
-        reason = f"by {escape_markdown(ctx.author.name)}#{ctx.author.discriminator}"
-
+        reason = expires_at = None
         if after is not None:
-            if "%" in reason:
-                raise commands.BadArgument('La ragione contiene il carattere illegale "%".')
-            if after.arg:
-                reason += f" for `{after.arg}`"
+            reason = after.arg or None
             if after.dt > after.now:
-                reason += f" until {after.dt.isoformat()}"
-
-        reason += "."
+                expires_at = after.dt
 
-        msg = self.bot.blocked_users.get(str(user.id))
-        if msg is None:
-            msg = ""
+        old_entry = await self.bot.blocklist.add(
+            user.id, reason, moderator_id=ctx.author.id, expires_at=expires_at
+        )
+        new_reason = self.bot.blocklist.format_reason(self.bot.blocklist.get(user.id))
 
-        if str(user.id) in self.bot.blocked_users and msg:
-            old_reason = msg.strip().rstrip(".")
+        if old_entry is not None:
+            old_reason = self.bot.blocklist.format_reason(old_entry)
             embed = discord.Embed(
                 title="Successo",
-                description=f"{mention} era bloccato precedentemente per {old_reason}.\n"
-                f"{mention} e' ora bloccato per {reason}",
+                description=f"{mention} era bloccato precedentemente {old_reason}.\n"
+                f"{mention} e' ora bloccato {new_reason}.",
                 color=self.bot.main_color,
             )
         else:
             embed = discord.Embed(
                 title="Success",
                 color=self.bot.main_color,
-                description=f"{mention} e' ora bloccato per {reason}",
+                description=f"{mention} e' ora bloccato {new_reason}.",
             )
-        self.bot.blocked_users[str(user.id)] = reason
-        await self.bot.config.update()
 
         return await ctx.send(embed=embed)
 
@@ -1111,37 +1310,36 @@ class Modmail(commands.Cog):
         mention = getattr(user, "mention", f"`{user.id}`")
         name = getattr(user, "name", f"`{user.id}`")
 
-        if str(user.id) in self.bot.blocked_users:
-            msg = self.bot.blocked_users.pop(str(user.id)) or ""
-            await self.bot.config.update()
+        entry = await self.bot.blocklist.remove(user.id)
 
-            if msg.startswith("Messaggio di sistema: "):
-                # Se un utente viene bloccato internamente (per esempio: sotto eta' minima account)
-                # Mostra un messaggio esteso col messaggio interno dentro
-                reason = msg[16:].strip().rstrip(".") or "nessuna ragione"
-                embed = discord.Embed(
-                    title="Successo",
-                    description=f"{mention} era stato precedentemente bloccato internamente per {reason}.\n"
-                    f"{mention} non e' piu' bloccato.",
-                    color=self.bot.main_color,
-                )
-                embed.set_footer(
-                    text="Comunque, se la stessa ragione del sistema viene applicata di nuovo, "
-                    f"{name} sara' automaticamente bloccato di nuovo. "
-                    f'Usa "{self.bot.prefix}blocked whitelist {user.id}" per whitelistare l\'utente.'
-                )
-            else:
-                embed = discord.Embed(
-                    title="Successo",
-                    color=self.bot.main_color,
-                    description=f"{mention} non e' piu' bloccato.",
-                )
-        else:
+        if entry is None:
             embed = discord.Embed(
                 title="Errore",
                 description=f"{mention} non e' bloccato.",
                 color=self.bot.error_color,
             )
+        elif entry["system"]:
+            # Se un utente viene bloccato internamente (per esempio: sotto eta' minima account)
+            # Mostra un messaggio esteso col messaggio interno dentro
+            reason = self.bot.blocklist.format_reason(entry)
+            reason = reason[len("Messaggio di sistema:") :].strip().rstrip(".")
+            embed = discord.Embed(
+                title="Successo",
+                description=f"{mention} era stato precedentemente bloccato internamente per "
+                f"{reason or 'nessuna ragione'}.\n{mention} non e' piu' bloccato.",
+                color=self.bot.main_color,
+            )
+            embed.set_footer(
+                text="Comunque, se la stessa ragione del sistema viene applicata di nuovo, "
+                f"{name} sara' automaticamente bloccato di nuovo. "
+                f'Usa "{self.bot.prefix}blocked whitelist {user.id}" per whitelistare l\'utente.'
+            )
+        else:
+            embed = discord.Embed(
+                title="Successo",
+                color=self.bot.main_color,
+                description=f"{mention} non e' piu' bloccato.",
+            )
 
         return await ctx.send(embed=embed)
 
@@ -1186,20 +1384,17 @@ class Modmail(commands.Cog):
             user_id = match_user_id(ctx.channel.topic)
             if user_id == -1:
                 logger.info("Impostando il canale del topic corrente a User ID.")
-                await ctx.channel.edit(topic=f"User ID: {ctx.thread.id}")
+                await ctx.channel.edit(topic=f"ID utente: {ctx.thread.id}")
             return await self.bot.add_reaction(ctx.message, sent_emoji)
 
         logger.info("Tentando di sistemare il thread rovinato %s.", ctx.channel.name)
 
         # Cerca la cache per il canale
-        user_id, thread = next(
-            ((k, v) for k, v in self.bot.threads.cache.items() if v.channel == ctx.channel),
-            (-1, None),
-        )
+        thread = self.bot.threads.channel_cache.get(ctx.channel.id)
         if thread is not None:
             logger.debug("Trovato thread con ID tamperato.")
             await ctx.channel.edit(
-                reason="Sistemazione thread Modmail rovinato", topic=f"User ID: {user_id}"
+                reason="Sistemazione thread Modmail rovinato", topic=f"ID utente: {thread.id}"
             )
             return await self.bot.add_reaction(ctx.message, sent_emoji)
 
@@ -1216,17 +1411,15 @@ class Modmail(commands.Cog):
                 if user_id != -1:
                     recipient = self.bot.get_user(user_id)
                     if recipient is None:
-                        self.bot.threads.cache[user_id] = thread = Thread(
-                            self.bot.threads, user_id, ctx.channel
-                        )
+                        thread = Thread(self.bot.threads, user_id, ctx.channel)
                     else:
-                        self.bot.threads.cache[user_id] = thread = Thread(
-                            self.bot.threads, recipient, ctx.channel
-                        )
+                        thread = Thread(self.bot.threads, recipient, ctx.channel)
+                    self.bot.threads.register(thread)
                     thread.ready = True
                     logger.info("Impostato topic canale corrente a User ID e creato nuovo thread.")
                     await ctx.channel.edit(
-                        reason="Sistemazione thread Modmail rovinato", topic=f"User ID: {user_id}"
+                        reason="Sistemazione thread Modmail rovinato",
+                        topic=f"ID utente: {user_id}",
                     )
                     return await self.bot.add_reaction(ctx.message, sent_emoji)
 
@@ -1267,19 +1460,16 @@ class Modmail(commands.Cog):
                         except discord.HTTPException:
                             pass
                 if recipient is None:
-                    self.bot.threads.cache[user.id] = thread = Thread(
-                        self.bot.threads, user_id, ctx.channel
-                    )
+                    thread = Thread(self.bot.threads, user.id, ctx.channel)
                 else:
-                    self.bot.threads.cache[user.id] = thread = Thread(
-                        self.bot.threads, recipient, ctx.channel
-                    )
+                    thread = Thread(self.bot.threads, recipient, ctx.channel)
+                self.bot.threads.register(thread)
                 thread.ready = True
                 logger.info("Impostato il topic canale a User ID e creato nuovo canale.")
                 await ctx.channel.edit(
                     reason="Sistemazione thread Modmail rovinato",
                     name=name,
-                    topic=f"User ID: {user.id}",
+                    topic=f"ID utente: {user.id}",
                 )
                 return await self.bot.add_reaction(ctx.message, sent_emoji)
 
@@ -23,6 +23,7 @@ from pkg_resources import parse_version
 
 from core import checks
 from core.changelog import Changelog
+from core.indexes import explain_queries
 from core.models import InvalidConfigError, PermissionLevel, getLogger
 from core.paginator import EmbedPaginatorSession, MessagePaginatorSession
 from core import utils
@@ -461,6 +462,77 @@ class Utilita(commands.Cog, name="Utilità"):
             )
         )
 
+    @debug.command(name="scheduler", aliases=["jobs"])
+    @checks.has_permissions(PermissionLevel.OWNER)
+    async def debug_scheduler(self, ctx):
+        """Mostra le operazioni programmate e il loro ritardo."""
+
+        stats = self.bot.scheduler.stats()
+        kinds = "\n".join(f"`{kind}`: {count}" for kind, count in stats["kinds"].most_common())
+
+        embed = discord.Embed(title="Operazioni programmate", color=self.bot.main_color)
+        embed.add_field(name="In attesa", value=str(stats["pending"]))
+        embed.add_field(name="In ritardo", value=str(stats["overdue"]))
+        embed.add_field(name="Eseguite", value=str(stats["dispatched"]))
+        embed.add_field(name="Per tipo", value=kinds or "Nessuna", inline=False)
+        embed.add_field(name="Ultimo ritardo", value=f"{stats['last_lag']:.3f} s")
+        embed.add_field(name="Ritardo massimo", value=f"{stats['max_lag']:.3f} s")
+        if stats["next_due"] is not None:
+            embed.set_footer(text="Prossima operazione")
+            embed.timestamp = stats["next_due"]
+        await ctx.send(embed=embed)
+
+    @debug.command(name="database", aliases=["db"])
+    @checks.has_permissions(PermissionLevel.OWNER)
+    async def debug_database(self, ctx):
+        """Mostra le statistiche delle scritture sul database."""
+
+        api = self.bot.api
+        average = api.log_bytes_returned / api.log_writes if api.log_writes else 0
+
+        embed = discord.Embed(title="Database", color=self.bot.main_color)
+        embed.add_field(name="Scritture dei log", value=str(api.log_writes))
+        embed.add_field(name="Byte ricevuti", value=str(api.log_bytes_returned))
+        embed.add_field(name="Byte per scrittura", value=f"{average:.1f}")
+        embed.add_field(name="Messaggi in coda", value=str(api.log_queue_size))
+        embed.add_field(name="Messaggi salvati", value=str(api.log_messages_written))
+        embed.add_field(
+            name="Durata salvataggio",
+            value=f"{api.last_log_flush * 1000:.1f} ms (max {api.max_log_flush * 1000:.1f} ms)",
+        )
+        embed.add_field(name="Scritture della configurazione", value=str(self.bot.config.writes))
+        log_meta = api.log_meta_cache
+        embed.add_field(
+            name="Cache dei log",
+            value=f"{len(log_meta)}/{log_meta.maxsize} log, "
+            f"{log_meta.hits} hit, {log_meta.misses} miss",
+        )
+        await ctx.send(embed=embed)
+
+    @debug.command(name="indexes", aliases=["index"])
+    @checks.has_permissions(PermissionLevel.OWNER)
+    @utils.trigger_typing
+    async def debug_indexes(self, ctx):
+        """Controlla quali query principali non usano un index."""
+
+        results = await explain_queries(self.bot.db)
+        missing = [name for name, indexes in results if not indexes]
+
+        embed = discord.Embed(
+            title="Index database",
+            color=self.bot.error_color if missing else self.bot.main_color,
+            description="\n".join(
+                f"`{name}`: "
+                + (", ".join(f"`{index}`" for index in indexes) or "**nessun index**")
+                for name, indexes in results
+            ),
+        )
+        if missing:
+            embed.set_footer(text=f"{len(missing)} query scansionano l'intera collezione.")
+        else:
+            embed.set_footer(text="Tutte le query usano un index.")
+        await ctx.send(embed=embed)
+
     @commands.command(aliases=["presence"])
     @checks.has_permissions(PermissionLevel.ADMINISTRATOR)
     async def activity(self, ctx, activity_type: str.lower, *, message: str = ""):
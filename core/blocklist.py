@@ -0,0 +1,204 @@
+import re
+import typing
+from datetime import datetime
+
+from core.models import getLogger
+
+logger = getLogger(__name__)
+
+
+class BlockList:
+    """
+    Keeps the blocked users in memory, backed by the `blocklist` collection.
+
+    Each entry is a dict with `user_id`, `reason`, `moderator_id`, `created_at`,
+    `expires_at` and `system` (whether it was added by the account_age or
+    guild_age checks). Temporary blocks are removed when they expire through
+    an "unblock" job of the bot's scheduler.
+
+    Parameters
+    ----------
+    bot : Bot
+        The Modmail bot.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._entries = {}
+        bot.scheduler.register("unblock", self._expire)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def __contains__(self, user_id: typing.Union[int, str]) -> bool:
+        return int(user_id) in self._entries
+
+    @property
+    def collection(self):
+        return self.bot.db.blocklist
+
+    def get(self, user_id: typing.Union[int, str]) -> typing.Optional[dict]:
+        return self._entries.get(int(user_id))
+
+    def is_blocked(self, user_id: typing.Union[int, str]) -> bool:
+        entry = self.get(user_id)
+        return entry is not None and not self.is_expired(entry)
+
+    @staticmethod
+    def is_expired(entry: dict) -> bool:
+        return entry["expires_at"] is not None and entry["expires_at"] <= datetime.utcnow()
+
+    async def load(self) -> None:
+        """Loads the entries from the database and migrates the legacy config entries."""
+        self._entries = {}
+        async for entry in self.collection.find({}, {"_id": 0}):
+            self._set(entry)
+
+        legacy = self.bot.config["blocked"]
+        if legacy:
+            logger.info("Sposto %d utenti bloccati nella blocklist.", len(legacy))
+            for user_id, reason in legacy.items():
+                entry = self._from_legacy(user_id, reason or "")
+                self._set(entry)
+                await self._save(entry)
+                await self._schedule_expiry(entry)
+            self.bot.config.remove("blocked")
+            await self.bot.config.update()
+
+        for entry in self._entries.values():
+            if (
+                entry["expires_at"] is not None
+                and self.bot.scheduler.get(self._job_key(entry["user_id"])) is None
+            ):
+                await self._schedule_expiry(entry)
+
+        logger.debug("Caricati %d utenti bloccati.", len(self._entries))
+
+    @staticmethod
+    def _job_key(user_id: int) -> str:
+        return f"unblock:{user_id}"
+
+    async def _schedule_expiry(self, entry: dict) -> None:
+        key = self._job_key(entry["user_id"])
+        if entry["expires_at"] is None:
+            await self.bot.scheduler.cancel(key)
+        else:
+            await self.bot.scheduler.schedule(
+                "unblock", key, entry["expires_at"], {"user_id": entry["user_id"]}
+            )
+
+    @staticmethod
+    def _from_legacy(user_id: str, reason: str) -> dict:
+        # etc "by xxx#1234 for `blah`  until 2019-10-14T21:12:45.559948."
+        expires_at = None
+        end_time = re.search(r"until ([^`]+?)\.$", reason) or re.search(r"%([^%]+?)%", reason)
+        if end_time is not None:
+            try:
+                expires_at = datetime.fromisoformat(end_time.group(1))
+            except ValueError:
+                pass
+        return {
+            "user_id": int(user_id),
+            "reason": reason.strip().rstrip(".") or None,
+            "moderator_id": None,
+            "created_at": datetime.utcnow(),
+            "expires_at": expires_at,
+            "system": reason.startswith("Messaggio di sistema:"),
+        }
+
+    def _set(self, entry: dict) -> None:
+        self._entries[entry["user_id"]] = entry
+
+    async def _save(self, entry: dict) -> None:
+        await self.collection.update_one(
+            {"user_id": entry["user_id"]}, {"$set": entry}, upsert=True
+        )
+
+    async def add(
+        self,
+        user_id: typing.Union[int, str],
+        reason: str = None,
+        *,
+        moderator_id: int = None,
+        expires_at: datetime = None,
+        system: bool = False,
+    ) -> typing.Optional[dict]:
+        """
+        Blocks a user, replacing their previous entry.
+
+        Returns
+        -------
+        Optional[dict]
+            The previous entry, if the user was already blocked.
+        """
+        previous = self.get(user_id)
+        entry = {
+            "user_id": int(user_id),
+            "reason": reason,
+            "moderator_id": moderator_id,
+            "created_at": datetime.utcnow(),
+            "expires_at": expires_at,
+            "system": system,
+        }
+        self._set(entry)
+        await self._save(entry)
+        if expires_at is not None or (previous and previous["expires_at"] is not None):
+            await self._schedule_expiry(entry)
+        return previous
+
+    def add_system(self, user_id: typing.Union[int, str], reason: str) -> None:
+        """Blocks a user from an internal check, the entry is saved in the background."""
+        entry = {
+            "user_id": int(user_id),
+            "reason": reason,
+            "moderator_id": None,
+            "created_at": datetime.utcnow(),
+            "expires_at": None,
+            "system": True,
+        }
+        previous = self.get(user_id)
+        self._set(entry)
+        self.bot.loop.create_task(self._save(entry))
+        if previous is not None and previous["expires_at"] is not None:
+            self.bot.loop.create_task(self._schedule_expiry(entry))
+
+    async def remove(self, user_id: typing.Union[int, str]) -> typing.Optional[dict]:
+        """
+        Unblocks a user.
+
+        Returns
+        -------
+        Optional[dict]
+            The removed entry, if the user was blocked.
+        """
+        entry = self._entries.pop(int(user_id), None)
+        if entry is not None:
+            await self.collection.delete_one({"user_id": int(user_id)})
+            if entry["expires_at"] is not None:
+                await self.bot.scheduler.cancel(self._job_key(entry["user_id"]))
+        return entry
+
+    async def _expire(self, job: dict) -> None:
+        user_id = job["data"]["user_id"]
+        entry = self.get(user_id)
+        # the entry may have been replaced since the job was scheduled
+        if entry is not None and entry["expires_at"] == job["due"]:
+            logger.debug("L'utente %s non è più bloccato.", user_id)
+            await self.remove(user_id)
+
+    def format_reason(self, entry: dict) -> str:
+        """Formats an entry the way the block commands show it."""
+        if entry["system"]:
+            return entry["reason"] or "Messaggio di sistema."
+
+        out = ""
+        if entry["moderator_id"] is not None:
+            out += f"da <@{entry['moderator_id']}>"
+        if entry["reason"]:
+            out += f" per `{entry['reason']}`"
+        if entry["expires_at"] is not None:
+            out += f" fino al {entry['expires_at'].isoformat(' ', 'seconds')} UTC"
+        return out.strip() or "Nessuna ragione specificata"
@@ -1,16 +1,131 @@
+import asyncio
 import secrets
-from datetime import datetime
+import warnings
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
 from json import JSONDecodeError
-from typing import Union
+from typing import Optional, Tuple, Union
 
 from discord import Member, DMChannel, TextChannel, Message
 
 from aiohttp import ClientResponseError, ClientResponse
+from bson import BSON, Binary, json_util
+from pymongo import UpdateOne
+from pymongo.errors import ConnectionFailure
 
-from core.models import getLogger
+from core.models import LRUCache, getLogger
+from core.stats import LOG_ROLLUP_PROJECTION, day_start, rollup_day
+from core.utils import parse_timestamp
 
 logger = getLogger(__name__)
 
+# the parts of a log that are needed once it is closed: its key and the preview message
+LOG_SUMMARY_PROJECTION = {"_id": 0, "key": 1, "messages": {"$slice": 1}}
+
+# the fields shown by the logs commands
+LOG_ENTRY_PROJECTION = {
+    "key": 1,
+    "created_at": 1,
+    "closed_at": 1,
+    "recipient": 1,
+    "creator": 1,
+    "closer": 1,
+    "messages": {"$slice": 5},
+}
+
+# the fields of a log kept in the metadata cache, see `ApiClient.get_log_meta`,
+# as a $project stage: only bucketed and archived logs store their message count
+LOG_META_PROJECTION = {
+    "_id": 0,
+    "key": 1,
+    "channel_id": 1,
+    "open": 1,
+    "closed_at": 1,
+    "recipient.id": 1,
+    "message_count": {"$ifNull": ["$message_count", {"$size": {"$ifNull": ["$messages", []]}}]},
+}
+
+# message types that count as a staff reply
+RESPONSE_TYPES = {"anonymous", "thread_message"}
+
+# messages per bucket of a bucketed log,
+# the first LOG_PREVIEW_SIZE messages are also kept in the log itself for previews
+LOG_BUCKET_SIZE = 500
+LOG_PREVIEW_SIZE = 5
+
+# closed logs moved into the archive per query by archive_closed_logs
+LOG_ARCHIVE_BATCH_SIZE = 100
+
+
+# documents converted per batch by migrate_log_dates
+LOG_MIGRATION_BATCH_SIZE = 100
+
+# the logs that still have timestamps stored as strings
+LEGACY_DATES_QUERY = {
+    "$or": [
+        {"created_at": {"$type": "string"}},
+        {"closed_at": {"$type": "string"}},
+        {"messages.timestamp": {"$type": "string"}},
+    ]
+}
+
+
+def date_range_query(field: str, *, after: datetime = None, before: datetime = None) -> dict:
+    """
+    Matches the documents where `field` is from `after` and before `before`.
+
+    Both the datetimes and the strings of the logs that were not migrated yet are matched.
+    """
+    native = {}
+    if after is not None:
+        native["$gte"] = after
+    if before is not None:
+        native["$lt"] = before
+    legacy = {op: str(value) for op, value in native.items()}
+    return {"$or": [{field: native}, {field: legacy}]}
+
+
+def _legacy_timestamps(messages: list) -> bool:
+    return any(isinstance(message.get("timestamp"), str) for message in messages)
+
+
+def _migrate_timestamps(messages: list) -> list:
+    migrated = []
+    for message in messages:
+        if isinstance(message.get("timestamp"), str):
+            try:
+                message = {**message, "timestamp": parse_timestamp(message["timestamp"])}
+            except (ValueError, OverflowError):
+                pass
+        migrated.append(message)
+    return migrated
+
+
+def pack_messages(messages: list) -> Binary:
+    """Compresses the messages of an archived log into a blob."""
+    return Binary(zlib.compress(BSON.encode({"messages": messages})))
+
+
+def unpack_messages(blob: bytes) -> list:
+    return BSON(zlib.decompress(blob)).decode()["messages"]
+
+
+# queued log messages are written in batches of up to LOG_BATCH_SIZE,
+# at most LOG_FLUSH_INTERVAL seconds after the first one was queued
+LOG_QUEUE_SIZE = 1000
+LOG_BATCH_SIZE = 100
+LOG_FLUSH_INTERVAL = 0.5
+
+# a batch that cannot reach the database is written again up to LOG_WRITE_RETRIES times,
+# waiting LOG_RETRY_DELAY seconds the first time and twice as long each following time
+LOG_WRITE_RETRIES = 5
+LOG_RETRY_DELAY = 1
+
+# log metadata kept in memory and for how long, in seconds
+LOG_META_CACHE_SIZE = 1024
+LOG_META_CACHE_TTL = 600
+
 
 class RequestClient:
     """
@@ -76,6 +191,27 @@ class RequestClient:
 
 
 class ApiClient(RequestClient):
+    def __init__(self, bot):
+        super().__init__(bot)
+        # message id (either side) -> link document
+        self._message_links = LRUCache(maxsize=4096)
+        # channel id -> key and message count of the open bucketed logs
+        self._log_layouts = LRUCache(maxsize=1024)
+        # channel id -> metadata of the log, see `get_log_meta`
+        self._log_meta = LRUCache(maxsize=LOG_META_CACHE_SIZE, ttl=LOG_META_CACHE_TTL)
+        self._log_queue = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
+        self._log_worker = None
+        # channel id -> log messages queued and not written yet, see `flush_logs`
+        self._pending_logs = Counter()
+        self._logs_written = asyncio.Condition()
+        # log writes and the size of the documents they returned
+        self.log_writes = 0
+        self.log_bytes_returned = 0
+        # queued log messages written so far and how long the last and slowest batch took
+        self.log_messages_written = 0
+        self.last_log_flush = 0.0
+        self.max_log_flush = 0.0
+
     @property
     def db(self):
         return self.bot.db
@@ -84,6 +220,26 @@ class ApiClient(RequestClient):
     def logs(self):
         return self.db.logs
 
+    @property
+    def log_messages(self):
+        return self.db.log_messages
+
+    @property
+    def log_archive(self):
+        return self.db.log_archive
+
+    @property
+    def log_rollups(self):
+        return self.db.log_rollups
+
+    @property
+    def message_links(self):
+        return self.db.message_links
+
+    @property
+    def thread_states(self):
+        return self.db.thread_states
+
     async def get_user_logs(self, user_id: Union[str, int]) -> list:
         query = {"recipient.id": str(user_id), "guild_id": str(self.bot.guild_id)}
         projection = {"messages": {"$slice": 5}}
@@ -91,6 +247,17 @@ class ApiClient(RequestClient):
 
         return await self.logs.find(query, projection).to_list(None)
 
+    def user_logs_query(self, user_id: Union[str, int], *, open: bool = False) -> dict:
+        return {"recipient.id": str(user_id), "guild_id": str(self.bot.guild_id), "open": open}
+
+    async def count_user_logs(self, user_id: Union[str, int], *, open: bool = False) -> int:
+        """Counts the open or closed logs of a user without fetching them."""
+        query = self.user_logs_query(user_id, open=open)
+        count = await self.logs.count_documents(query)
+        if not open:
+            count += await self.log_archive.count_documents(query)
+        return count
+
     async def get_latest_user_logs(self, user_id: Union[str, int]):
         query = {"recipient.id": str(user_id), "guild_id": str(self.bot.guild_id), "open": False}
         projection = {"messages": {"$slice": 5}}
@@ -98,29 +265,434 @@ class ApiClient(RequestClient):
 
         return await self.logs.find_one(query, projection, limit=1, sort=[("closed_at", -1)])
 
+    def responded_logs_query(self, user_id: Union[str, int]) -> dict:
+        return {"responders": str(user_id), "guild_id": str(self.bot.guild_id), "open": False}
+
     async def get_responded_logs(self, user_id: Union[str, int]) -> list:
-        query = {
-            "open": False,
-            "messages": {
-                "$elemMatch": {
-                    "author.id": str(user_id),
-                    "author.mod": True,
-                    "type": {"$in": ["anonymous", "thread_message"]},
-                }
-            },
-        }
-        return await self.logs.find(query).to_list(None)
+        """
+        Returns the closed logs the user replied to, archived ones included, with all their messages.
+
+        Deprecated, page through `responded_logs_query` instead.
+        """
+        warnings.warn(
+            "ApiClient.get_responded_logs è deprecato, usa ApiClient.responded_logs_query.",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        query = self.responded_logs_query(user_id)
+        logs = await self.logs.find(query).to_list(None)
+        logs += await self.log_archive.find(query).to_list(None)
+        return [await self._load_messages(log) for log in logs]
+
+    @staticmethod
+    def get_responders(messages: list) -> list:
+        """Returns the ids of the staff members that replied in the messages."""
+        responders = []
+        for message in messages:
+            author_id = message["author"]["id"]
+            if (
+                message["author"].get("mod")
+                and message.get("type") in RESPONSE_TYPES
+                and author_id not in responders
+            ):
+                responders.append(author_id)
+        return responders
+
+    async def backfill_responders(self) -> int:
+        """
+        Fills `responders` for the logs and archived logs created before it existed,
+        returns how many.
+        """
+        count = 0
+        query = {"responders": {"$exists": False}}
+        projections = [
+            (self.logs, {"key": 1, "bucketed": 1, "messages.author": 1, "messages.type": 1}),
+            (self.log_archive, {"key": 1, "messages_blob": 1}),
+        ]
+        for collection, projection in projections:
+            async for log in collection.find(query, projection):
+                responders = self.get_responders(await self.get_log_messages(log))
+                await collection.update_one(
+                    {"key": log["key"], "responders": {"$exists": False}},
+                    {"$set": {"responders": responders}},
+                )
+                count += 1
+        if count:
+            logger.info("Filled the responders of %d logs.", count)
+        return count
+
+    @staticmethod
+    def get_message_role(message: dict) -> str:
+        """
+        Returns who sent a log message: `user` for the recipient, `staff` for
+        the replies, otherwise the type of the message (`internal`, `system`).
+        """
+        if not message["author"].get("mod"):
+            return "user"
+        if message.get("type") in RESPONSE_TYPES:
+            return "staff"
+        return message.get("type") or "internal"
+
+    @classmethod
+    def get_metrics_update(cls, messages: list) -> dict:
+        """
+        The update that adds `messages` to the `metrics` of a log.
+
+        The messages are counted by role in `metrics.messages`, and
+        `metrics.first_message_at`, `metrics.first_response_at` and
+        `metrics.last_activity_at` are moved with `$min`/`$max`, so the
+        batches can be written in any order.
+        """
+        update = {"$inc": {}, "$min": {}, "$max": {}}
+        for message in messages:
+            role = cls.get_message_role(message)
+            field = f"metrics.messages.{role}"
+            update["$inc"][field] = update["$inc"].get(field, 0) + 1
+
+            timestamp = parse_timestamp(message.get("timestamp"))
+            if timestamp is None:
+                continue
+            first = {"user": "first_message_at", "staff": "first_response_at"}.get(role)
+            if first is not None:
+                field = f"metrics.{first}"
+                update["$min"][field] = min(update["$min"].get(field, timestamp), timestamp)
+            field = "metrics.last_activity_at"
+            update["$max"][field] = max(update["$max"].get(field, timestamp), timestamp)
+        return {op: fields for op, fields in update.items() if fields}
+
+    async def backfill_metrics(self) -> int:
+        """
+        Fills `metrics` for the logs and archived logs created before it existed,
+        returns how many.
+        """
+        count = 0
+        query = {"metrics": {"$exists": False}}
+        projections = [
+            (
+                self.logs,
+                {
+                    "key": 1,
+                    "bucketed": 1,
+                    "messages.author": 1,
+                    "messages.type": 1,
+                    "messages.timestamp": 1,
+                },
+            ),
+            (self.log_archive, {"key": 1, "messages_blob": 1}),
+        ]
+        for collection, projection in projections:
+            async for log in collection.find(query, projection):
+                messages = await self.get_log_messages(log)
+                update = self.get_metrics_update(messages) or {"$set": {"metrics": {}}}
+                await collection.update_one(
+                    {"key": log["key"], "metrics": {"$exists": False}}, update
+                )
+                count += 1
+        if count:
+            logger.info("Filled the metrics of %d logs.", count)
+        return count
+
+    async def rollup_closed_logs(self) -> int:
+        """
+        Folds the logs closed on the days that are over into `log_rollups`, one document per day.
+
+        Each day is computed again from all its closed logs, archived ones
+        included, and the next day to roll up is saved after it, so it can be
+        interrupted and started again. Returns how many days were rolled up.
+        """
+        guild_id = str(self.bot.guild_id)
+        state_id = f"{guild_id}:state"
+        state = await self.log_rollups.find_one({"_id": state_id})
+        if state is not None:
+            day = state["next_day"]
+        else:
+            # starts from the first closed log
+            query = {"guild_id": guild_id, "open": False, "closed_at": {"$ne": None}}
+            closed = []
+            for collection in (self.logs, self.log_archive):
+                log = await collection.find_one(query, {"closed_at": 1}, sort=[("closed_at", 1)])
+                if log is not None:
+                    closed.append(parse_timestamp(log["closed_at"]))
+            if not closed:
+                return 0
+            day = day_start(min(closed))
+
+        today = day_start(datetime.utcnow())
+        count = 0
+        while day < today:
+            next_day = day + timedelta(days=1)
+            query = {
+                "guild_id": guild_id,
+                "open": False,
+                **date_range_query("closed_at", after=day, before=next_day),
+            }
+            logs = []
+            for collection in (self.logs, self.log_archive):
+                logs += await collection.find(query, LOG_ROLLUP_PROJECTION).to_list(None)
+            if logs:
+                rollup = rollup_day(guild_id, day, logs)
+                await self.log_rollups.replace_one({"_id": rollup["_id"]}, rollup, upsert=True)
+
+            day = next_day
+            await self.log_rollups.update_one(
+                {"_id": state_id}, {"$set": {"next_day": day}}, upsert=True
+            )
+            count += 1
+        if count:
+            logger.info("Rolled up the logs of %d days.", count)
+        return count
+
+    async def get_rollups(self, start: datetime, end: datetime) -> list:
+        """Returns the daily rollups from `start` and before `end`, oldest first."""
+        query = {"guild_id": str(self.bot.guild_id), "date": {"$gte": start, "$lt": end}}
+        return await self.log_rollups.find(query, sort=[("date", 1)]).to_list(None)
+
+    async def migrate_log_dates(self) -> int:
+        """
+        Converts the timestamps that older logs store as strings into datetimes.
+
+        Only the documents that still have strings are read, in batches, so it
+        can be interrupted and started again. The messages of open logs are
+        converted once they are closed, on a later run. Returns how many
+        documents were converted.
+        """
+        if await self.db.migrations.find_one({"_id": "log_dates"}) is not None:
+            return 0
+
+        count = 0
+        pending = False
+        for collection in (self.logs, self.log_archive, self.log_messages):
+            converted, left = await self._migrate_dates(collection)
+            count += converted
+            pending = pending or left
+
+        if count:
+            logger.info("Converted the timestamps of %d log documents.", count)
+        if not pending:
+            await self.db.migrations.update_one(
+                {"_id": "log_dates"}, {"$set": {"done_at": datetime.utcnow()}}, upsert=True
+            )
+        return count
+
+    async def _migrate_dates(self, collection) -> Tuple[int, bool]:
+        """Returns how many documents of a collection were converted and whether some are left."""
+        count = 0
+        pending = False
+        last_id = None
+        while True:
+            query = LEGACY_DATES_QUERY
+            if last_id is not None:
+                query = {**query, "_id": {"$gt": last_id}}
+            docs = (
+                await collection.find(query, sort=[("_id", 1)])
+                .limit(LOG_MIGRATION_BATCH_SIZE)
+                .to_list(None)
+            )
+            if not docs:
+                return count, pending
+            last_id = docs[-1]["_id"]
+
+            if collection is self.log_messages:
+                # buckets of open logs are still being written to
+                keys = list({doc["log_key"] for doc in docs})
+                open_keys = set(
+                    await self.logs.distinct("key", {"key": {"$in": keys}, "open": True})
+                )
+            else:
+                open_keys = {doc.get("key") for doc in docs if doc.get("open")}
+
+            requests = []
+            for doc in docs:
+                update = {}
+                for field in ("created_at", "closed_at"):
+                    if isinstance(doc.get(field), str):
+                        try:
+                            update[field] = parse_timestamp(doc[field])
+                        except (ValueError, OverflowError):
+                            logger.warning("Invalid %s in %s: %s.", field, doc["_id"], doc[field])
+
+                messages = doc.get("messages", [])
+                if doc.get("key", doc.get("log_key")) in open_keys:
+                    pending = pending or _legacy_timestamps(messages)
+                    messages = None
+                query = {"_id": doc["_id"]}
+                if messages and _legacy_timestamps(messages):
+                    update["messages"] = _migrate_timestamps(messages)
+                    # the messages could have been moved into buckets meanwhile
+                    query["messages"] = {"$size": len(messages)}
+                if messages is not None and "messages_blob" in doc:
+                    update["messages_blob"] = await self.bot.loop.run_in_executor(
+                        None,
+                        lambda blob: pack_messages(_migrate_timestamps(unpack_messages(blob))),
+                        doc["messages_blob"],
+                    )
+
+                if update:
+                    requests.append(UpdateOne(query, {"$set": update}))
+
+            if requests:
+                result = await collection.bulk_write(requests, ordered=False)
+                count += result.matched_count
+                pending = pending or result.matched_count < len(requests)
+
+    async def index_logs(self) -> int:
+        """
+        Adds the closed logs stored while the search index was disabled to it.
+
+        The last indexed log is saved in the index, so it resumes where it
+        stopped. Returns how many logs were indexed.
+        """
+        index = self.bot.search_index
+        state = await index.get_state("backfill")
+        if state == "done":
+            return 0
+
+        state = json_util.loads(state) if state else {"collection": "logs", "last_id": None}
+        collections = ["logs", "log_archive"]
+        count = 0
+        for name in collections[collections.index(state["collection"]) :]:
+            if name != state["collection"]:
+                state = {"collection": name, "last_id": None}
+            while True:
+                query = {"guild_id": str(self.bot.guild_id), "open": False}
+                if state["last_id"] is not None:
+                    query["_id"] = {"$gt": state["last_id"]}
+                logs = (
+                    await self.db[name]
+                    .find(query, sort=[("_id", 1)])
+                    .limit(LOG_MIGRATION_BATCH_SIZE)
+                    .to_list(None)
+                )
+                if not logs:
+                    break
+                for log in logs:
+                    messages = await self.get_log_messages(log)
+                    await index.index_log(log["channel_id"], log["key"], messages)
+                state["last_id"] = logs[-1]["_id"]
+                await index.set_state("backfill", json_util.dumps(state))
+                count += len(logs)
+
+        await index.set_state("backfill", "done")
+        if count:
+            logger.info("Added %d logs to the search index.", count)
+        return count
+
+    async def search_logs_query(self, text: str) -> dict:
+        """The query for the closed logs containing `text`."""
+        search = {"$text": {"$search": f'"{text}"'}}
+        query = {"guild_id": str(self.bot.guild_id), "open": False}
+
+        # messages of bucketed logs are indexed in their buckets
+        keys = await self.log_messages.distinct("log_key", search)
+        if keys:
+            return {**query, "$or": [search, {"key": {"$in": keys}}]}
+        return {**query, **search}
+
+    async def search_logs(self, text: str, limit: Optional[int] = None) -> list:
+        """
+        Finds the closed logs containing `text`, with their preview.
+
+        Deprecated, page through `search_logs_query` instead.
+        """
+        warnings.warn(
+            "ApiClient.search_logs è deprecato, usa ApiClient.search_logs_query.",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        query = await self.search_logs_query(text)
+        return await self.logs.find(query, LOG_ENTRY_PROJECTION).to_list(limit)
 
     async def get_open_logs(self) -> list:
-        query = {"open": True}
-        return await self.logs.find(query).to_list(None)
+        """Returns the metadata of the open logs, see `get_log_meta`."""
+        pipeline = [{"$match": {"open": True}}, {"$project": LOG_META_PROJECTION}]
+        logs = await self.logs.aggregate(pipeline).to_list(None)
+        return [self._cache_log_meta(log) for log in logs]
 
-    async def get_log(self, channel_id: Union[str, int]) -> dict:
+    def _cache_log_meta(self, log: dict) -> dict:
+        meta = {
+            "key": log["key"],
+            "channel_id": log["channel_id"],
+            "open": log.get("open", False),
+            "closed_at": log.get("closed_at"),
+            "recipient_id": log.get("recipient", {}).get("id"),
+            "message_count": log.get("message_count", 0),
+        }
+        self._log_meta.set(log["channel_id"], meta)
+        return meta
+
+    async def get_log_meta(self, channel_id: Union[str, int]) -> Optional[dict]:
+        """
+        Returns the metadata of the log of a channel, without its messages.
+
+        The metadata is cached by channel id and kept up to date by the
+        writes of this client, so the thread commands do not need to fetch
+        the whole log.
+
+        Returns
+        -------
+        Optional[dict]
+            The key, channel id, open state, closing date, recipient id and
+            message count of the log, `None` if it does not exist.
+        """
+        meta = self._log_meta.get(str(channel_id))
+        if meta is not None:
+            return meta
+
+        pipeline = [
+            {"$match": {"channel_id": str(channel_id)}},
+            {"$limit": 1},
+            {"$project": LOG_META_PROJECTION},
+        ]
+        for collection in (self.logs, self.log_archive):
+            logs = await collection.aggregate(pipeline).to_list(None)
+            if logs:
+                return self._cache_log_meta(logs[0])
+        return None
+
+    async def get_log(self, channel_id: Union[str, int]) -> Optional[dict]:
+        """
+        Returns the whole log of a channel, archived or not, with all its messages.
+
+        Deprecated, use `get_log_meta` and `get_log_messages`.
+        """
+        warnings.warn(
+            "ApiClient.get_log è deprecato, usa ApiClient.get_log_meta e "
+            "ApiClient.get_log_messages.",
+            DeprecationWarning,
+            stacklevel=2,
+        )
         logger.debug("Retrieving channel %s logs.", channel_id)
-        return await self.logs.find_one({"channel_id": str(channel_id)})
+        query = {"channel_id": str(channel_id)}
+        log = await self.logs.find_one(query)
+        if log is None:
+            log = await self.log_archive.find_one(query)
+        if log is None:
+            return None
+        return await self._load_messages(log)
+
+    async def _load_messages(self, log: dict) -> dict:
+        """Puts all the messages of a bucketed or archived log back into it."""
+        if log.get("bucketed") or "messages_blob" in log:
+            log["messages"] = await self.get_log_messages(log)
+            log.pop("messages_blob", None)
+        return log
+
+    async def get_log_messages(self, log: dict) -> list:
+        """Returns all the messages of a log or archived log, whichever way they are stored."""
+        if "messages_blob" in log:
+            return await self.bot.loop.run_in_executor(None, unpack_messages, log["messages_blob"])
+        if not log.get("bucketed"):
+            return log.get("messages", [])
+
+        messages = []
+        async for bucket in self.log_messages.find(
+            {"log_key": log["key"]}, {"_id": 0, "messages": 1}, sort=[("seq", 1)]
+        ):
+            messages.extend(bucket["messages"])
+        return messages
 
     async def get_log_link(self, channel_id: Union[str, int]) -> str:
-        doc = await self.get_log(channel_id)
+        doc = await self.get_log_meta(channel_id)
         logger.debug("Retrieving log link for channel %s.", channel_id)
         prefix = self.bot.config["log_url_prefix"].strip("/")
         if prefix == "NONE":
@@ -133,13 +705,14 @@ class ApiClient(RequestClient):
         self, recipient: Member, channel: TextChannel, creator: Member
     ) -> str:
         key = secrets.token_hex(6)
+        bucketed = self.bot.config.get("log_message_buckets")
 
         await self.logs.insert_one(
             {
                 "_id": key,
                 "key": key,
                 "open": True,
-                "created_at": str(datetime.utcnow()),
+                "created_at": datetime.utcnow(),
                 "closed_at": None,
                 "channel_id": str(channel.id),
                 "guild_id": str(self.bot.guild_id),
@@ -160,8 +733,26 @@ class ApiClient(RequestClient):
                 },
                 "closer": None,
                 "messages": [],
+                "responders": [],
+                "metrics": {},
+                **({"bucketed": True, "message_count": 0} if bucketed else {}),
             }
         )
+        if bucketed:
+            self._log_layouts.set(str(channel.id), {"key": key, "count": 0})
+        self._log_meta.set(
+            str(channel.id),
+            {
+                "key": key,
+                "channel_id": str(channel.id),
+                "open": True,
+                "closed_at": None,
+                "recipient_id": str(recipient.id),
+                "message_count": 0,
+            },
+        )
+        if self.bot.search_index is not None:
+            self.bot.search_index.add_log(channel.id, key)
         logger.debug("Created a log entry, key %s.", key)
         prefix = self.bot.config["log_url_prefix"].strip("/")
         if prefix == "NONE":
@@ -169,37 +760,158 @@ class ApiClient(RequestClient):
         return f"{self.bot.config['log_url'].strip('/')}{'/' + prefix if prefix else ''}/{key}"
 
     async def delete_log_entry(self, key: str) -> bool:
+        for channel_id, meta in list(self._log_meta.items()):
+            if meta["key"] == key:
+                self._log_meta.pop(channel_id)
+        if self.bot.search_index is not None:
+            self.bot.search_index.delete_log(key)
         result = await self.logs.delete_one({"key": key})
+        if result.deleted_count == 1:
+            await self.log_messages.delete_many({"log_key": key})
+            return True
+        result = await self.log_archive.delete_one({"key": key})
         return result.deleted_count == 1
 
+    async def bucket_log(self, key: str) -> bool:
+        """
+        Moves the messages of a closed log into buckets.
+
+        Returns `False` if the log does not exist, is open or is already bucketed.
+        """
+        log = await self.logs.find_one(
+            {"key": key, "open": False, "bucketed": {"$ne": True}}, {"messages": 1}
+        )
+        if log is None:
+            return False
+
+        messages = log.get("messages", [])
+        for seq in range(0, (len(messages) + LOG_BUCKET_SIZE - 1) // LOG_BUCKET_SIZE):
+            bucket = messages[seq * LOG_BUCKET_SIZE : (seq + 1) * LOG_BUCKET_SIZE]
+            await self.log_messages.replace_one(
+                {"log_key": key, "seq": seq},
+                {"log_key": key, "seq": seq, "count": len(bucket), "messages": bucket},
+                upsert=True,
+            )
+        await self.logs.update_one(
+            {"key": key},
+            {
+                "$set": {
+                    "bucketed": True,
+                    "message_count": len(messages),
+                    "messages": messages[:LOG_PREVIEW_SIZE],
+                }
+            },
+        )
+        return True
+
+    async def bucket_closed_logs(self) -> int:
+        """Moves the messages of every closed log into buckets, returns how many were moved."""
+        count = 0
+        query = {"open": False, "bucketed": {"$ne": True}}
+        async for log in self.logs.find(query, {"key": 1}):
+            if await self.bucket_log(log["key"]):
+                count += 1
+        if count:
+            logger.info("Moved the messages of %d logs into buckets.", count)
+        return count
+
+    async def archive_log(self, key: str, retention: timedelta = None) -> bool:
+        """
+        Moves a closed log into the archive, with its messages compressed.
+
+        The first messages are also kept uncompressed for the previews.
+
+        Parameters
+        ----------
+        key : str
+            The key of the log.
+        retention : timedelta, optional
+            How long after being closed the log is deleted from the archive.
+
+        Returns
+        -------
+        bool
+            `False` if the log does not exist or is still open.
+        """
+        log = await self.logs.find_one({"key": key, "open": False})
+        if log is None:
+            return False
+
+        messages = await self.get_log_messages(log)
+        log.pop("bucketed", None)
+        log["messages"] = messages[:LOG_PREVIEW_SIZE]
+        log["message_count"] = len(messages)
+        log["messages_blob"] = await self.bot.loop.run_in_executor(None, pack_messages, messages)
+        log["archived_at"] = datetime.utcnow()
+        if retention:
+            # removed by the TTL index of the archive
+            log["expires_at"] = parse_timestamp(log["closed_at"]) + retention
+
+        # the log stays in the hot collection until it is safe in the archive
+        await self.log_archive.replace_one({"key": key}, log, upsert=True)
+        await self.logs.delete_one({"key": key})
+        await self.log_messages.delete_many({"log_key": key})
+        return True
+
+    async def archive_closed_logs(self, older_than: timedelta, retention: timedelta = None) -> int:
+        """Archives the logs closed more than `older_than` ago, returns how many were moved."""
+        query = {
+            "open": False,
+            **date_range_query("closed_at", before=datetime.utcnow() - older_than),
+        }
+        count = 0
+        while True:
+            keys = [
+                log["key"]
+                async for log in self.logs.find(query, {"key": 1}).limit(LOG_ARCHIVE_BATCH_SIZE)
+            ]
+            archived = 0
+            for key in keys:
+                if await self.archive_log(key, retention):
+                    archived += 1
+            count += archived
+            if len(keys) < LOG_ARCHIVE_BATCH_SIZE or not archived:
+                break
+        if count:
+            logger.info("Archived %d closed logs.", count)
+        return count
+
     async def get_config(self) -> dict:
         conf = await self.db.config.find_one({"bot_id": self.bot.user.id})
         if conf is None:
             logger.debug("Creating a new config entry for bot %s.", self.bot.user.id)
-            await self.db.config.insert_one({"bot_id": self.bot.user.id})
-            return {"bot_id": self.bot.user.id}
+            conf = {"bot_id": self.bot.user.id, "config_version": 0}
+            await self.db.config.insert_one(dict(conf))
         return conf
 
-    async def update_config(self, data: dict):
-        toset = self.bot.config.filter_valid(data)
-        unset = self.bot.config.filter_valid(
-            {k: 1 for k in self.bot.config.all_keys if k not in data}
-        )
+    async def update_config(self, toset: dict, unset: dict, version: int) -> bool:
+        """
+        Applies a partial update to the config document.
 
-        if toset and unset:
-            return await self.db.config.update_one(
-                {"bot_id": self.bot.user.id}, {"$set": toset, "$unset": unset}
-            )
+        The update only goes through if the stored `config_version` still
+        matches `version`, returns `False` when it was changed concurrently.
+        """
+        update = {"$inc": {"config_version": 1}}
         if toset:
-            return await self.db.config.update_one({"bot_id": self.bot.user.id}, {"$set": toset})
+            update["$set"] = toset
         if unset:
-            return await self.db.config.update_one({"bot_id": self.bot.user.id}, {"$unset": unset})
+            update["$unset"] = unset
+
+        query = {"bot_id": self.bot.user.id}
+        query["config_version"] = version if version else {"$in": [0, None]}
+        logger.debug("Updating config keys %s.", ", ".join({**toset, **unset}))
+
+        result = await self.db.config.update_one(query, update)
+        return result.matched_count == 1
 
     async def edit_message(self, message_id: Union[int, str], new_content: str) -> None:
-        await self.logs.update_one(
-            {"messages.message_id": str(message_id)},
-            {"$set": {"messages.$.content": new_content, "messages.$.edited": True}},
+        query = {"messages.message_id": str(message_id)}
+        update = {"$set": {"messages.$.content": new_content, "messages.$.edited": True}}
+        await asyncio.gather(
+            self.logs.update_one(query, update), self.log_messages.update_one(query, update)
         )
+        if self.bot.search_index is not None:
+            self.bot.search_index.edit_message(message_id, new_content)
 
     async def append_log(
         self,
@@ -208,12 +920,18 @@ class ApiClient(RequestClient):
         message_id: str = "",
         channel_id: str = "",
         type_: str = "thread_message",
-    ) -> dict:
+    ) -> None:
+        """
+        Queues a message to be added to a log.
+
+        The messages are written in batches by a background worker,
+        this waits while the queue is full.
+        """
         channel_id = str(channel_id) or str(message.channel.id)
         message_id = str(message_id) or str(message.id)
 
         data = {
-            "timestamp": str(message.created_at),
+            "timestamp": message.created_at,
             "message_id": message_id,
             "author": {
                 "id": str(message.author.id),
@@ -236,15 +954,320 @@ class ApiClient(RequestClient):
             ],
         }
 
-        return await self.logs.find_one_and_update(
-            {"channel_id": channel_id}, {"$push": {"messages": data}}, return_document=True
+        self._start_log_worker()
+        self._pending_logs[channel_id] += 1
+        await self._log_queue.put((channel_id, data))
+
+    def _start_log_worker(self) -> None:
+        if self._log_worker is None or self._log_worker.done():
+            self._log_worker = self.bot.loop.create_task(self._run_log_worker())
+
+    async def _run_log_worker(self) -> None:
+        loop = self.bot.loop
+        while True:
+            batch = [await self._log_queue.get()]
+            deadline = loop.time() + LOG_FLUSH_INTERVAL
+            while len(batch) < LOG_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._log_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            started = loop.time()
+            try:
+                await self._write_logs(batch)
+                if self.bot.search_index is not None:
+                    self.bot.search_index.add_messages(batch)
+            except Exception:
+                logger.error("Failed to write %d log messages.", len(batch), exc_info=True)
+            finally:
+                self.last_log_flush = loop.time() - started
+                self.max_log_flush = max(self.max_log_flush, self.last_log_flush)
+                self.log_messages_written += len(batch)
+                for channel_id, _ in batch:
+                    self._pending_logs[channel_id] -= 1
+                    if not self._pending_logs[channel_id]:
+                        del self._pending_logs[channel_id]
+                    self._log_queue.task_done()
+                async with self._logs_written:
+                    self._logs_written.notify_all()
+
+    async def _bulk_write(self, collection, requests: list):
+        """Runs a `bulk_write` of the log worker, again after a while if the database is unreachable."""
+        delay = LOG_RETRY_DELAY
+        for attempt in range(LOG_WRITE_RETRIES + 1):
+            try:
+                return await collection.bulk_write(requests, ordered=False)
+            except ConnectionFailure:
+                if attempt == LOG_WRITE_RETRIES:
+                    raise
+                logger.warning(
+                    "Could not write %d log updates, retrying in %d seconds.",
+                    len(requests),
+                    delay,
+                    exc_info=True,
+                )
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def flush_logs(self, channel_id: Union[int, str], timeout: float = 5) -> None:
+        """Waits until the queued messages of a channel are written, e.g. before closing its log."""
+        channel_id = str(channel_id)
+        if not self._pending_logs[channel_id]:
+            return
+        try:
+            async with self._logs_written:
+                await asyncio.wait_for(
+                    self._logs_written.wait_for(lambda: not self._pending_logs[channel_id]),
+                    timeout,
+                )
+        except asyncio.TimeoutError:
+            logger.warning("The queued messages of channel %s are not written yet.", channel_id)
+
+    async def drain_logs(self, timeout: float = 10) -> None:
+        """Waits until the queued log messages are written, used on shutdown."""
+        pending = sum(self._pending_logs.values())
+        if not pending:
+            return
+        logger.info("Writing %d queued log messages.", pending)
+        self._start_log_worker()
+        try:
+            await asyncio.wait_for(self._log_queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error("%d log messages could not be written.", sum(self._pending_logs.values()))
+
+    @property
+    def log_queue_size(self) -> int:
+        return self._log_queue.qsize()
+
+    @property
+    def log_meta_cache(self) -> LRUCache:
+        return self._log_meta
+
+    async def _write_logs(self, batch: list) -> None:
+        # channel id -> messages, in the order they were queued
+        grouped = {}
+        for channel_id, data in batch:
+            grouped.setdefault(channel_id, []).append(data)
+
+        # the updates are guarded so that a bulk_write retried after it reached
+        # the database doesn't add the same messages twice
+        legacy = [channel_id for channel_id in grouped if channel_id not in self._log_layouts]
+        if legacy:
+            result = await self._bulk_write(
+                self.logs,
+                [
+                    UpdateOne(
+                        {
+                            "channel_id": channel_id,
+                            "bucketed": {"$ne": True},
+                            "messages.message_id": {"$ne": grouped[channel_id][0]["message_id"]},
+                        },
+                        self._append_update(grouped[channel_id]),
+                    )
+                    for channel_id in legacy
+                ],
+            )
+            self.log_writes += 1
+            if result.matched_count < len(legacy):
+                # some of them are bucketed logs that are not loaded yet
+                await self._load_log_layouts(legacy)
+            for channel_id in legacy:
+                if channel_id not in self._log_layouts:
+                    self._count_log_messages(channel_id, len(grouped[channel_id]))
+
+        bucketed = [channel_id for channel_id in grouped if channel_id in self._log_layouts]
+        if not bucketed:
+            return
+
+        layouts = []
+        log_ops = []
+        bucket_ops = []
+        for channel_id in bucketed:
+            layout = self._log_layouts.get(channel_id)
+            layouts.append((channel_id, layout))
+            messages = grouped[channel_id]
+            start = layout["count"]
+            count = start + len(messages)
+
+            update = self._append_update(messages[: max(LOG_PREVIEW_SIZE - start, 0)], messages)
+            update.setdefault("$inc", {})["message_count"] = len(messages)
+            log_ops.append(UpdateOne({"key": layout["key"], "message_count": start}, update))
+
+            index = start
+            while index < count:
+                seq = index // LOG_BUCKET_SIZE
+                end = min((seq + 1) * LOG_BUCKET_SIZE, count)
+                bucket = messages[index - start : end - start]
+                bucket_ops.append(
+                    UpdateOne(
+                        {"log_key": layout["key"], "seq": seq},
+                        {
+                            "$addToSet": {"messages": {"$each": bucket}},
+                            "$max": {"count": end - seq * LOG_BUCKET_SIZE},
+                        },
+                        upsert=True,
+                    )
+                )
+                index = end
+
+        try:
+            await asyncio.gather(
+                self._bulk_write(self.logs, log_ops),
+                self._bulk_write(self.log_messages, bucket_ops),
+            )
+        except Exception:
+            # loaded again with the count that was actually written
+            for channel_id, _ in layouts:
+                self._log_layouts.pop(channel_id)
+            raise
+        self.log_writes += 2
+        for channel_id, layout in layouts:
+            layout["count"] += len(grouped[channel_id])
+            self._count_log_messages(channel_id, len(grouped[channel_id]))
+
+    def _count_log_messages(self, channel_id: str, count: int) -> None:
+        meta = self._log_meta.get(channel_id, count=False)
+        if meta is not None:
+            meta["message_count"] += count
+
+    def _append_update(self, messages: list, appended: list = None) -> dict:
+        """
+        The update that pushes `messages` into a log, adds the staff members
+        that replied in `appended` to its responders and `appended` to its metrics.
+        """
+        appended = messages if appended is None else appended
+        update = self.get_metrics_update(appended)
+        if messages:
+            update["$push"] = {"messages": {"$each": messages}}
+        responders = self.get_responders(appended)
+        if responders:
+            update["$addToSet"] = {"responders": {"$each": responders}}
+        return update
+
+    async def _load_log_layouts(self, channel_ids: list) -> None:
+        async for log in self.logs.find(
+            {"channel_id": {"$in": channel_ids}, "bucketed": True},
+            {"channel_id": 1, "key": 1, "message_count": 1},
+        ):
+            self._log_layouts.set(
+                log["channel_id"], {"key": log["key"], "count": log.get("message_count", 0)}
+            )
+
+    async def post_log(
+        self,
+        channel_id: Union[int, str],
+        data: dict,
+        *,
+        projection: Optional[dict] = LOG_SUMMARY_PROJECTION,
+    ) -> dict:
+        """
+        Updates a log and returns it.
+
+        Only the key and the first message are returned by default,
+        pass `projection=None` to get the whole document.
+        """
+        # the close preview needs the messages that are still queued
+        await self.flush_logs(channel_id)
+        self._log_layouts.pop(str(channel_id))
+        meta = self._log_meta.get(str(channel_id), count=False)
+        if meta is not None:
+            meta.update((k, data[k]) for k in ("open", "closed_at") if k in data)
+        log = await self.logs.find_one_and_update(
+            {"channel_id": str(channel_id)},
+            {"$set": data},
+            projection=projection,
+            return_document=True,
         )
+        self.log_writes += 1
+        if log is not None:
+            self.log_bytes_returned += len(BSON.encode(log))
+        return log
+
+    def _cache_message_link(self, link: dict) -> None:
+        self._message_links.set(link["thread_message_id"], link)
+        if link["dm_message_id"] is not None:
+            self._message_links.set(link["dm_message_id"], link)
+
+    async def add_message_link(
+        self,
+        channel_id: int,
+        thread_message_id: int,
+        dm_message_id: Optional[int] = None,
+        *,
+        recipient_id: int,
+        author_id: int,
+        kind: str,
+    ) -> dict:
+        """
+        Stores the relation between a thread channel message and its DM counterpart.
 
-    async def post_log(self, channel_id: Union[int, str], data: dict) -> dict:
-        return await self.logs.find_one_and_update(
-            {"channel_id": str(channel_id)}, {"$set": data}, return_document=True
+        `kind` is one of "thread_message", "anonymous", "recipient" or "note".
+        Notes have no DM counterpart.
+        """
+        link = {
+            "channel_id": int(channel_id),
+            "thread_message_id": int(thread_message_id),
+            "dm_message_id": int(dm_message_id) if dm_message_id is not None else None,
+            "recipient_id": int(recipient_id),
+            "author_id": int(author_id),
+            "kind": kind,
+        }
+        self._cache_message_link(link)
+        await self.message_links.update_one(
+            {"thread_message_id": link["thread_message_id"]}, {"$set": link}, upsert=True
+        )
+        return link
+
+    async def get_message_link(self, message_id: Union[int, str]) -> Optional[dict]:
+        """Retrieves a link by either the thread channel or the DM message ID."""
+        message_id = int(message_id)
+        link = self._message_links.get(message_id)
+        if link is not None:
+            return link
+
+        logger.debug("Retrieving message link for %s.", message_id)
+        link = await self.message_links.find_one(
+            {"$or": [{"thread_message_id": message_id}, {"dm_message_id": message_id}]},
+            {"_id": 0},
+        )
+        if link is not None:
+            self._cache_message_link(link)
+        return link
+
+    async def get_last_message_link(self, channel_id: Union[int, str], kinds: list) -> dict:
+        return await self.message_links.find_one(
+            {"channel_id": int(channel_id), "kind": {"$in": kinds}},
+            {"_id": 0},
+            sort=[("thread_message_id", -1)],
         )
 
+    async def has_message_links(self, channel_id: Union[int, str]) -> bool:
+        return await self.message_links.find_one({"channel_id": int(channel_id)}) is not None
+
+    async def delete_message_links(self, channel_id: Union[int, str]) -> None:
+        channel_id = int(channel_id)
+        for key, link in tuple(self._message_links.items()):
+            if link["channel_id"] == channel_id:
+                self._message_links.pop(key)
+        await self.message_links.delete_many({"channel_id": channel_id})
+
+    async def get_thread_states(self) -> list:
+        logger.debug("Retrieving thread states.")
+        return await self.thread_states.find({}, {"_id": 0}).to_list(None)
+
+    async def update_thread_state(self, recipient_id: Union[int, str], update: dict) -> None:
+        """Applies an update document to the state of a single thread."""
+        await self.thread_states.update_one(
+            {"recipient_id": int(recipient_id)}, update, upsert=True
+        )
+
+    async def delete_thread_state(self, recipient_id: Union[int, str]) -> None:
+        await self.thread_states.delete_one({"recipient_id": int(recipient_id)})
+
 
 class PluginDatabaseClient:
     def __init__(self, bot):
@@ -41,6 +41,8 @@ class ConfigManager:
         "anon_reply_without_command": False,
         # logging
         "log_channel_id": None,
+        "log_archive_after": isodate.Duration(),
+        "log_retention": isodate.Duration(),
         # threads
         "sent_emoji": "✅",
         "blocked_emoji": "🚫",
@@ -95,6 +97,8 @@ class ConfigManager:
         "notification_squad": {},
         "subscriptions": {},
         "closures": {},
+        # set while the bot runs without the search index, see `bot.on_ready`
+        "log_search_index_stale": False,
         # misc
         "plugins": [],
         "aliases": {},
@@ -113,11 +117,24 @@ class ConfigManager:
         # Logging
         "log_level": "INFO",
         "enable_plugins": True,
+        # Database
+        "config_write_behind": False,
+        "config_write_behind_delay": 1.0,
+        "log_message_buckets": False,
+        "log_search_index": False,
+        "log_search_index_path": None,
     }
 
     colors = {"mod_color", "recipient_color", "main_color", "error_color"}
 
-    time_deltas = {"account_age", "guild_age", "thread_auto_close", "thread_cooldown"}
+    time_deltas = {
+        "account_age",
+        "guild_age",
+        "thread_auto_close",
+        "thread_cooldown",
+        "log_archive_after",
+        "log_retention",
+    }
 
     booleans = {
         "user_typing",
@@ -128,6 +145,9 @@ class ConfigManager:
         "thread_auto_close_silently",
         "thread_move_notify",
         "enable_plugins",
+        "config_write_behind",
+        "log_message_buckets",
+        "log_search_index",
     }
 
     special_types = {"status", "activity_type"}
@@ -135,9 +155,24 @@ class ConfigManager:
     defaults = {**public_keys, **private_keys, **protected_keys}
     all_keys = set(defaults.keys())
 
+    # keys whose converted value is cached by `get`
+    typed_keys = {*colors, *time_deltas, *booleans, *special_types}
+
     def __init__(self, bot):
         self.bot = bot
         self._cache = {}
+        # converted values of the typed keys, see `get`
+        self._converted = {}
+        # last known database state of the persisted keys
+        self._persisted = {}
+        # keys that may differ from `_persisted`
+        self._dirty = set()
+        self._version = 0
+        self._update_lock = asyncio.Lock()
+        self._flush_task = None
+        self._flush_pending = False
+        # number of writes sent to the database
+        self.writes = 0
         self.ready_event = asyncio.Event()
         self.config_help = {}
 
@@ -170,6 +205,7 @@ class ConfigManager:
                         exc_info=True,
                     )
         self._cache = data
+        self._converted.clear()
 
         config_help_json = os.path.join(
             os.path.dirname(os.path.abspath(__file__)), "config_help.json"
@@ -179,16 +215,154 @@ class ConfigManager:
 
         return self._cache
 
+    @property
+    def write_behind(self) -> bool:
+        return self.get("config_write_behind")
+
+    @property
+    def write_behind_delay(self) -> float:
+        try:
+            return max(float(self["config_write_behind_delay"]), 0)
+        except (TypeError, ValueError):
+            logger.warning("CONFIG_WRITE_BEHIND_DELAY non è valido, uso quello predefinito.")
+            return self.remove("config_write_behind_delay")
+
     async def update(self):
-        """Updates the config with data from the cache"""
-        await self.bot.api.update_config(self.filter_default(self._cache))
+        """
+        Saves the changed keys to the database.
+
+        With `config_write_behind` enabled the write is deferred and coalesced
+        with the other updates made in the next `config_write_behind_delay` seconds,
+        use `flush` when the changes must be saved before continuing.
+        """
+        if not self.write_behind:
+            return await self.flush()
+
+        self._flush_pending = True
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = self.bot.loop.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await self.wait_until_ready()
+        while self._flush_pending:
+            await asyncio.sleep(self.write_behind_delay)
+            self._flush_pending = False
+            try:
+                await self.flush()
+            except Exception:
+                logger.error("Non è stato possibile salvare la configurazione.", exc_info=True)
+
+    async def flush(self) -> None:
+        """Writes the keys that changed since the last write to the database"""
+        async with self._update_lock:
+            for _ in range(5):
+                toset, unset, written = self._diff()
+                if not toset and not unset:
+                    return
+                self.writes += 1
+                try:
+                    updated = await self.bot.api.update_config(toset, unset, self._version)
+                except Exception:
+                    self._dirty.update(written)
+                    raise
+                if updated:
+                    self._version += 1
+                    self._persisted.update(written)
+                    return
+                logger.warning("La configurazione è stata modificata altrove, la riallineo.")
+                self._rebase(await self.bot.api.get_config(), written)
+            logger.error("Non è stato possibile salvare la configurazione.")
+
+    def _diff(self) -> typing.Tuple[dict, dict, dict]:
+        """
+        Computes the `$set` and `$unset` documents for the dirty keys.
+
+        Dict values are diffed per entry, so changing a single blocked user
+        only writes `blocked.<id>`.
+        """
+        toset, unset, written = {}, {}, {}
+
+        for key in tuple(self._dirty):
+            value = self._cache.get(key, self.defaults[key])
+            old = self._persisted.get(key, self.defaults[key])
+            if (key not in self.public_keys and key not in self.private_keys) or value == old:
+                # not saved, or only read
+                self._dirty.discard(key)
+                continue
+            if not isinstance(value, (dict, list)):
+                # a dict or list can still be changed in place by whoever read it,
+                # it stays dirty until a diff finds it unchanged
+                self._dirty.discard(key)
+            written[key] = deepcopy(value)
+
+            if (
+                isinstance(value, dict)
+                and isinstance(old, dict)
+                and old
+                and all(self._valid_path(k) for k in {*value, *old})
+            ):
+                for k, v in value.items():
+                    if k not in old or old[k] != v:
+                        toset[f"{key}.{k}"] = written[key][k]
+                for k in old:
+                    if k not in value:
+                        unset[f"{key}.{k}"] = ""
+            elif value == self.defaults[key]:
+                unset[key] = ""
+            else:
+                toset[key] = written[key]
+
+        return toset, unset, written
+
+    @staticmethod
+    def _valid_path(key: typing.Any) -> bool:
+        key = str(key)
+        return bool(key) and "." not in key and not key.startswith("$")
+
+    def _rebase(self, data: dict, pending: dict) -> None:
+        """
+        Merges a newer database document into the cache after a version conflict.
+
+        Keys that were not changed locally take the database value, keys that
+        were changed locally keep the local value (entry by entry for dicts).
+        """
+        data = {k.lower(): v for k, v in data.items()}
+        self._version = data.get("config_version", 0)
+
+        for key in {*self.public_keys, *self.private_keys}:
+            remote = data.get(key, deepcopy(self.defaults[key]))
+            base = self._persisted.get(key, self.defaults[key])
+            if remote == base:
+                continue
+
+            self._converted.pop(key, None)
+            if key not in pending:
+                self._cache[key] = deepcopy(remote)
+            elif isinstance(remote, dict) and isinstance(base, dict):
+                local = self._cache.get(key)
+                if isinstance(local, dict):
+                    for k in {*remote, *base}:
+                        if local.get(k, Default) != base.get(k, Default):
+                            continue  # changed locally
+                        if k in remote:
+                            local[k] = deepcopy(remote[k])
+                        else:
+                            local.pop(k, None)
+            self._persisted[key] = deepcopy(remote)
+            self._dirty.add(key)
 
     async def refresh(self) -> dict:
         """Refreshes internal cache with data from database"""
-        for k, v in (await self.bot.api.get_config()).items():
+        data = await self.bot.api.get_config()
+        self._version = data.get("config_version", 0)
+        self._persisted = {}
+        self._converted.clear()
+        for k, v in data.items():
             k = k.lower()
             if k in self.all_keys:
                 self._cache[k] = v
+                self._persisted[k] = deepcopy(v)
+                self._dirty.discard(k)
         if not self.ready_event.is_set():
             self.ready_event.set()
             logger.debug("Successfully fetched configurations from database.")
@@ -203,6 +377,8 @@ class ConfigManager:
         if key not in self.all_keys:
             raise InvalidConfigError(f'La configurazione "{key}" non è valida.')
         self._cache[key] = item
+        self._converted.pop(key, None)
+        self._dirty.add(key)
 
     def __getitem__(self, key: str) -> typing.Any:
         key = key.lower()
@@ -210,17 +386,34 @@ class ConfigManager:
             raise InvalidConfigError(f'La configurazione "{key}" non è valida.')
         if key not in self._cache:
             self._cache[key] = deepcopy(self.defaults[key])
-        return self._cache[key]
+        value = self._cache[key]
+        if isinstance(value, (dict, list)):
+            # could be modified in place by the caller
+            self._dirty.add(key)
+        return value
 
     def __delitem__(self, key: str) -> None:
         return self.remove(key)
 
     def get(self, key: str, convert=True) -> typing.Any:
+        if convert:
+            try:
+                return self._converted[key]
+            except KeyError:
+                pass
+
         value = self.__getitem__(key)
 
         if not convert:
             return value
 
+        key = key.lower()
+        if key in self.typed_keys:
+            value = self._convert(key, value)
+            self._converted[key] = value
+        return value
+
+    def _convert(self, key: str, value: typing.Any) -> typing.Any:
         if key in self.colors:
             try:
                 return int(value.lstrip("#"), base=16)
@@ -336,6 +529,8 @@ class ConfigManager:
         if key in self._cache:
             del self._cache[key]
         self._cache[key] = deepcopy(self.defaults[key])
+        self._converted.pop(key, None)
+        self._dirty.add(key)
         return self._cache[key]
 
     def items(self) -> typing.Iterable:
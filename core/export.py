@@ -0,0 +1,320 @@
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import typing
+from datetime import datetime
+
+from bson import json_util
+from dateutil import parser
+
+from core.clients import date_range_query, unpack_messages
+from core.models import getLogger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = getLogger(__name__)
+
+# logs read from the cursor, compressed and written at a time
+EXPORT_BATCH_SIZE = 500
+
+EXPORT_FORMATS = {"gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+
+# exported one after the other
+EXPORT_COLLECTIONS = ("logs", "log_archive")
+
+
+def export_query(
+    guild_id: typing.Union[int, str],
+    *,
+    after: datetime = None,
+    before: datetime = None,
+    recipient_id: typing.Union[int, str] = None,
+    closer_id: typing.Union[int, str] = None,
+) -> dict:
+    """
+    Builds the filter of the logs to export.
+
+    Parameters
+    ----------
+    guild_id : Union[int, str]
+        The guild of the logs.
+    after : datetime, optional
+        Only the logs created from this moment (UTC).
+    before : datetime, optional
+        Only the logs created before this moment (UTC).
+    recipient_id : Union[int, str], optional
+        Only the logs of this recipient.
+    closer_id : Union[int, str], optional
+        Only the logs closed by this user.
+    """
+    query = {"guild_id": str(guild_id)}
+    if after is not None or before is not None:
+        query.update(date_range_query("created_at", after=after, before=before))
+    if recipient_id is not None:
+        query["recipient.id"] = str(recipient_id)
+    if closer_id is not None:
+        query["closer.id"] = str(closer_id)
+    return query
+
+
+def export_format(fmt: str) -> str:
+    """
+    The format an export in `fmt` is written in: zstd needs the optional
+    zstandard package, without it the export falls back to gzip.
+    """
+    if fmt == "zstd" and zstandard is None:
+        logger.warning("Il pacchetto zstandard non è installato, esportazione in gzip.")
+        return "gzip"
+    return fmt
+
+
+def _compressor(fmt: str) -> typing.Callable[[bytes], bytes]:
+    if fmt == "gzip":
+        return gzip.compress
+    if fmt == "zstd":
+        if zstandard is None:
+            raise ValueError("Il pacchetto zstandard è necessario per esportare in zstd.")
+        return zstandard.ZstdCompressor().compress
+    raise ValueError(f"Formato di esportazione sconosciuto: {fmt}.")
+
+
+def _write_chunk(path: str, offset: int, compress, logs: list) -> int:
+    """Encodes a chunk of logs into its own gzip member/zstd frame, returns the new file size."""
+    lines = []
+    for log in logs:
+        log.pop("_id")
+        log.pop("bucketed", None)
+        blob = log.pop("messages_blob", None)
+        if blob is not None:
+            log["messages"] = unpack_messages(blob)
+        lines.append(json.dumps(log, default=str, ensure_ascii=False))
+    chunk = compress(("\n".join(lines) + "\n").encode())
+
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        # anything past the last checkpoint is from an interrupted run
+        f.truncate(offset)
+        f.seek(offset)
+        f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    return offset + len(chunk)
+
+
+class LogExporter:
+    """
+    Exports the logs to a compressed JSONL file, one log per line.
+
+    The logs, then the archived ones, are read in `_id` order with a cursor
+    and written in chunks of `EXPORT_BATCH_SIZE`, each compressed as a separate
+    gzip member or zstd frame in a thread so the event loop isn't blocked.
+    After every chunk a checkpoint with the last exported `_id` and the size
+    of the file is saved next to it, an interrupted export started again with
+    the same output continues from there. The checkpoint is removed when the
+    export finishes.
+
+    Parameters
+    ----------
+    db : AsyncIOMotorDatabase
+        The Modmail database.
+    path : str
+        The output file.
+    query : dict
+        The logs to export, see `export_query`.
+    fmt : str
+        "gzip" or "zstd", see `export_format`.
+    """
+
+    def __init__(self, db, path: str, query: dict, fmt: str = "gzip"):
+        self.db = db
+        self.path = path
+        self.query = query
+        self.fmt = fmt
+        self._compress = _compressor(fmt)
+        self.exported = 0
+        self.offset = 0
+        self.collection = None
+        self.last_id = None
+
+    @property
+    def checkpoint_path(self) -> str:
+        return self.path + ".checkpoint"
+
+    def _load_checkpoint(self) -> bool:
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return False
+
+        if checkpoint["query"] != json_util.dumps(self.query) or checkpoint["format"] != self.fmt:
+            raise ValueError(
+                f"Il checkpoint di {self.path} appartiene ad un'altra esportazione, "
+                "scegli un altro file."
+            )
+        self.exported = checkpoint["exported"]
+        self.offset = checkpoint["offset"]
+        self.collection = checkpoint["collection"]
+        self.last_id = json_util.loads(checkpoint["last_id"])
+        return True
+
+    def _save_checkpoint(self) -> None:
+        checkpoint = {
+            "query": json_util.dumps(self.query),
+            "format": self.fmt,
+            "exported": self.exported,
+            "offset": self.offset,
+            "collection": self.collection,
+            "last_id": json_util.dumps(self.last_id),
+        }
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp, self.checkpoint_path)
+
+    async def _add_messages(self, logs: list) -> None:
+        """Puts back the messages of the bucketed logs."""
+        bucketed = {log["key"]: log for log in logs if log.get("bucketed")}
+        if not bucketed:
+            return
+
+        for log in bucketed.values():
+            log["messages"] = []
+        async for bucket in self.db.log_messages.find(
+            {"log_key": {"$in": list(bucketed)}},
+            {"_id": 0, "log_key": 1, "messages": 1},
+            sort=[("log_key", 1), ("seq", 1)],
+        ):
+            bucketed[bucket["log_key"]]["messages"].extend(bucket["messages"])
+
+    async def _write_batch(self, logs: list) -> None:
+        await self._add_messages(logs)
+        self.offset = await asyncio.get_event_loop().run_in_executor(
+            None, _write_chunk, self.path, self.offset, self._compress, logs
+        )
+        self.exported += len(logs)
+        self._save_checkpoint()
+
+    async def run(self, progress: typing.Callable[[int], typing.Awaitable] = None) -> int:
+        """
+        Runs the export, resuming it if there is a checkpoint.
+
+        Parameters
+        ----------
+        progress : Callable[[int], Awaitable], optional
+            Awaited with the number of exported logs after each chunk.
+
+        Returns
+        -------
+        int
+            The number of exported logs.
+        """
+        collections = EXPORT_COLLECTIONS
+        if self._load_checkpoint():
+            logger.info("Ripresa l'esportazione di %s da %d log.", self.path, self.exported)
+            collections = collections[collections.index(self.collection) :]
+        elif os.path.exists(self.path):
+            raise ValueError(f"Il file {self.path} esiste già.")
+
+        for collection in collections:
+            query = self.query
+            if collection == self.collection:
+                query = {**query, "_id": {"$gt": self.last_id}}
+            else:
+                self.collection = collection
+                self.last_id = None
+
+            cursor = self.db[collection].find(
+                query, sort=[("_id", 1)], batch_size=EXPORT_BATCH_SIZE
+            )
+            batch = []
+            async for log in cursor:
+                self.last_id = log["_id"]
+                batch.append(log)
+                if len(batch) >= EXPORT_BATCH_SIZE:
+                    await self._write_batch(batch)
+                    batch = []
+                    if progress is not None:
+                        await progress(self.exported)
+            if batch:
+                await self._write_batch(batch)
+
+        if not os.path.exists(self.path):
+            # nothing matched, still leave an empty file behind
+            open(self.path, "wb").close()
+
+        try:
+            os.remove(self.checkpoint_path)
+        except FileNotFoundError:
+            pass
+        logger.info("Esportati %d log in %s.", self.exported, self.path)
+        return self.exported
+
+
+def _parse_date(value: str) -> datetime:
+    try:
+        return parser.parse(value)
+    except (ValueError, OverflowError):
+        raise argparse.ArgumentTypeError(f"Data non valida: {value}.")
+
+
+def main() -> None:
+    """Exports the logs without starting the bot: `python -m core.export output.jsonl.gz`."""
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv()
+
+    argparser = argparse.ArgumentParser(
+        prog="python -m core.export",
+        description="Esporta i log dei thread in un file JSONL compresso. "
+        "Se interrotta, l'esportazione riprende rilanciando lo stesso comando.",
+    )
+    argparser.add_argument("output", help="il file in cui esportare i log")
+    argparser.add_argument("--format", choices=EXPORT_FORMATS, default="gzip")
+    argparser.add_argument("--after", type=_parse_date, help="solo i log creati da questa data")
+    argparser.add_argument(
+        "--before", type=_parse_date, help="solo i log creati prima di questa data"
+    )
+    argparser.add_argument("--recipient", type=int, help="solo i log di questo utente")
+    argparser.add_argument("--closer", type=int, help="solo i log chiusi da questo utente")
+    argparser.add_argument(
+        "--guild", type=int, default=os.getenv("GUILD_ID"), help="default: GUILD_ID"
+    )
+    argparser.add_argument(
+        "--mongo-uri", default=os.getenv("MONGO_URI"), help="default: MONGO_URI"
+    )
+    args = argparser.parse_args()
+
+    if args.guild is None or args.mongo_uri is None:
+        argparser.error("GUILD_ID e MONGO_URI sono necessari.")
+
+    query = export_query(
+        args.guild,
+        after=args.after,
+        before=args.before,
+        recipient_id=args.recipient,
+        closer_id=args.closer,
+    )
+    fmt = export_format(args.format)
+    if fmt != args.format:
+        print("Il pacchetto zstandard non è installato, i log saranno esportati in gzip.")
+    db = AsyncIOMotorClient(args.mongo_uri).modmail_bot
+    exporter = LogExporter(db, args.output, query, fmt)
+
+    async def progress(exported):
+        print(f"{exported} log esportati...", flush=True)
+
+    try:
+        exported = asyncio.get_event_loop().run_until_complete(exporter.run(progress))
+    except ValueError as e:
+        argparser.exit(1, f"{e}\n")
+    print(f"Esportati {exported} log in {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import typing
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+
+from core.models import getLogger
+
+logger = getLogger(__name__)
+
+
+def _index(keys: list, **kwargs) -> IndexModel:
+    return IndexModel(keys, background=True, **kwargs)
+
+
+INDEXES = {
+    "logs": [
+        # append_log, post_log, get_log_meta
+        _index([("channel_id", ASCENDING)]),
+        # delete_log_entry, bucket_log
+        _index([("key", ASCENDING)]),
+        # get_user_logs, count_user_logs, get_latest_user_logs (thread cooldown)
+        _index(
+            [
+                ("recipient.id", ASCENDING),
+                ("guild_id", ASCENDING),
+                ("open", ASCENDING),
+                ("closed_at", DESCENDING),
+            ]
+        ),
+        # logs responded
+        _index(
+            [
+                ("responders", ASCENDING),
+                ("guild_id", ASCENDING),
+                ("open", ASCENDING),
+                ("closed_at", DESCENDING),
+            ]
+        ),
+        # logs closed-by
+        _index(
+            [
+                ("closer.id", ASCENDING),
+                ("guild_id", ASCENDING),
+                ("open", ASCENDING),
+                ("closed_at", DESCENDING),
+            ]
+        ),
+        # edit_message
+        _index([("messages.message_id", ASCENDING)]),
+        # get_open_logs, archive_closed_logs
+        _index([("open", ASCENDING), ("closed_at", ASCENDING)]),
+        # logs search
+        _index([("messages.content", TEXT), ("messages.author.name", TEXT), ("key", TEXT)]),
+    ],
+    # the same lookups as the logs, except for the search
+    "log_archive": [
+        _index([("key", ASCENDING)], unique=True),
+        _index([("channel_id", ASCENDING)]),
+        _index(
+            [
+                ("recipient.id", ASCENDING),
+                ("guild_id", ASCENDING),
+                ("open", ASCENDING),
+                ("closed_at", DESCENDING),
+            ]
+        ),
+        _index(
+            [
+                ("responders", ASCENDING),
+                ("guild_id", ASCENDING),
+                ("open", ASCENDING),
+                ("closed_at", DESCENDING),
+            ]
+        ),
+        _index(
+            [
+                ("closer.id", ASCENDING),
+                ("guild_id", ASCENDING),
+                ("open", ASCENDING),
+                ("closed_at", DESCENDING),
+            ]
+        ),
+        # rollup_closed_logs
+        _index([("open", ASCENDING), ("closed_at", ASCENDING)]),
+        # log_retention
+        _index([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "log_messages": [
+        _index([("log_key", ASCENDING), ("seq", ASCENDING)], unique=True),
+        _index([("messages.message_id", ASCENDING)]),
+        _index([("messages.content", TEXT), ("messages.author.name", TEXT)]),
+    ],
+    "message_links": [
+        _index([("thread_message_id", ASCENDING)], unique=True),
+        _index([("dm_message_id", ASCENDING)]),
+        _index([("channel_id", ASCENDING), ("thread_message_id", DESCENDING)]),
+    ],
+    "blocklist": [_index([("user_id", ASCENDING)], unique=True)],
+    "thread_states": [_index([("recipient_id", ASCENDING)], unique=True)],
+    "jobs": [_index([("key", ASCENDING)], unique=True), _index([("due", ASCENDING)])],
+    # stats
+    "log_rollups": [_index([("guild_id", ASCENDING), ("date", ASCENDING)])],
+}
+
+# indexes replaced by the ones above
+OBSOLETE_INDEXES = {
+    "logs": ["messages.content_text_messages.author.name_text"],
+}
+
+# name, collection, filter and sort of the queries that should be using an index
+CORE_QUERIES = [
+    ("append_log / post_log / get_log_meta", "logs", {"channel_id": "0"}, None),
+    ("delete_log_entry", "logs", {"key": "0"}, None),
+    ("get_user_logs", "logs", {"recipient.id": "0", "guild_id": "0"}, None),
+    ("count_user_logs", "logs", {"recipient.id": "0", "guild_id": "0", "open": False}, None),
+    (
+        "get_latest_user_logs",
+        "logs",
+        {"recipient.id": "0", "guild_id": "0", "open": False},
+        [("closed_at", DESCENDING)],
+    ),
+    (
+        "logs closed-by",
+        "logs",
+        {"closer.id": "0", "guild_id": "0", "open": False},
+        [("closed_at", DESCENDING)],
+    ),
+    (
+        "logs responded",
+        "logs",
+        {"responders": "0", "guild_id": "0", "open": False},
+        [("closed_at", DESCENDING)],
+    ),
+    ("edit_message", "logs", {"messages.message_id": "0"}, None),
+    ("get_open_logs", "logs", {"open": True}, None),
+    ("archive_closed_logs", "logs", {"open": False, "closed_at": {"$lt": "0"}}, None),
+    (
+        "rollup_closed_logs",
+        "logs",
+        {"guild_id": "0", "open": False, "closed_at": {"$gte": "0", "$lt": "0"}},
+        None,
+    ),
+    (
+        "rollup_closed_logs (archive)",
+        "log_archive",
+        {"guild_id": "0", "open": False, "closed_at": {"$gte": "0", "$lt": "0"}},
+        None,
+    ),
+    ("stats", "log_rollups", {"guild_id": "0", "date": {"$gte": "0"}}, [("date", ASCENDING)]),
+    ("get_log_meta (archive)", "log_archive", {"channel_id": "0"}, None),
+    ("delete_log_entry (archive)", "log_archive", {"key": "0"}, None),
+    (
+        "logs (archive)",
+        "log_archive",
+        {"recipient.id": "0", "guild_id": "0", "open": False},
+        [("closed_at", DESCENDING)],
+    ),
+    (
+        "logs closed-by (archive)",
+        "log_archive",
+        {"closer.id": "0", "guild_id": "0", "open": False},
+        [("closed_at", DESCENDING)],
+    ),
+    ("get_log_messages", "log_messages", {"log_key": "0"}, [("seq", ASCENDING)]),
+    (
+        "get_message_link",
+        "message_links",
+        {"$or": [{"thread_message_id": 0}, {"dm_message_id": 0}]},
+        None,
+    ),
+    (
+        "get_last_message_link",
+        "message_links",
+        {"channel_id": 0, "kind": {"$in": ["thread_message"]}},
+        [("thread_message_id", DESCENDING)],
+    ),
+]
+
+
+async def ensure_indexes(db) -> None:
+    """
+    Creates the declared indexes that are missing and drops the obsolete ones.
+
+    Indexes that already exist are left untouched, so this can run on every startup.
+    """
+    for collection, names in OBSOLETE_INDEXES.items():
+        existing = await db[collection].index_information()
+        for name in names:
+            if name in existing:
+                logger.info("Dropping old index: %s", name)
+                await db[collection].drop_index(name)
+
+    for collection, indexes in INDEXES.items():
+        created = await db[collection].create_indexes(indexes)
+        logger.debug("Ensured the indexes of %s: %s.", collection, ", ".join(created))
+
+
+def _plan_indexes(plan: dict) -> typing.Tuple[typing.List[str], bool]:
+    """Returns the indexes used by a query plan and whether it scans a collection."""
+    indexes = []
+    collscan = plan.get("stage") == "COLLSCAN"
+    if "indexName" in plan:
+        indexes.append(plan["indexName"])
+    children = plan.get("inputStages", [])
+    if "inputStage" in plan:
+        children = [plan["inputStage"], *children]
+    for child in children:
+        child_indexes, child_collscan = _plan_indexes(child)
+        indexes += child_indexes
+        collscan = collscan or child_collscan
+    return indexes, collscan
+
+
+async def explain_queries(db) -> typing.List[typing.Tuple[str, typing.List[str]]]:
+    """
+    Explains the core queries.
+
+    Returns
+    -------
+    List[Tuple[str, List[str]]]
+        The name of each query and the indexes it uses,
+        the list is empty if it scans the whole collection.
+    """
+    results = []
+    for name, collection, query, sort in CORE_QUERIES:
+        cursor = db[collection].find(query)
+        if sort is not None:
+            cursor = cursor.sort(sort)
+        explained = await cursor.explain()
+        indexes, collscan = _plan_indexes(explained["queryPlanner"]["winningPlan"])
+        results.append((name, [] if collscan else indexes))
+    return results
@@ -1,6 +1,8 @@
 import logging
 import re
 import sys
+import time
+from collections import OrderedDict
 from enum import IntEnum
 from logging.handlers import RotatingFileHandler
 from string import Formatter
@@ -174,3 +176,74 @@ class SafeFormatter(Formatter):
         except (IndexError, KeyError):
             pass
         return "<Invalid>", first
+
+
+class LRUCache:
+    """
+    A small in-memory mapping that evicts the least recently used entries.
+
+    Parameters
+    ----------
+    maxsize : int
+        The maximum number of entries kept in memory.
+    ttl : float, optional
+        How long, in seconds, an entry stays valid. Entries never expire if `None`.
+
+    Attributes
+    ----------
+    hits : int
+        The number of lookups that were served from the cache.
+    misses : int
+        The number of lookups that were not found in the cache.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, Default, count=False) is not Default
+
+    def get(self, key, default=None, *, count=True):
+        try:
+            expires, value = self._data[key]
+        except KeyError:
+            if count:
+                self.misses += 1
+            return default
+
+        if expires is not None and expires < time.monotonic():
+            del self._data[key]
+            if count:
+                self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        if count:
+            self.hits += 1
+        return value
+
+    def set(self, key, value) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def items(self):
+        return ((k, v) for k, (_, v) in self._data.items())
+
+    def pop(self, key, default=None):
+        try:
+            return self._data.pop(key)[1]
+        except KeyError:
+            return default
+
+    def clear(self) -> None:
+        self._data.clear()
@@ -65,19 +65,34 @@ class PaginatorSession:
         """
         await self._create_base(item)
 
-        if len(self.pages) == 1:
+        if self.page_count == 1:
             self.running = False
             return
 
         self.running = True
         for reaction in self.reaction_map:
-            if len(self.pages) == 2 and reaction in "⏮⏭":
+            if self.page_count == 2 and reaction in "⏮⏭":
                 continue
             await self.ctx.bot.add_reaction(self.base, reaction)
 
     async def _create_base(self, item) -> None:
         raise NotImplementedError
 
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+    async def get_page(self, index: int) -> typing.Any:
+        """
+        Get a page by page number.
+
+        Parameters
+        ----------
+        index : int
+            The index of the page.
+        """
+        return self.pages[index]
+
     async def show_page(self, index: int) -> None:
         """
         Show a page by page number.
@@ -87,11 +102,11 @@ class PaginatorSession:
         index : int
             The index of the page.
         """
-        if not 0 <= index < len(self.pages):
+        if not 0 <= index < self.page_count:
             return
 
         self.current = index
-        page = self.pages[index]
+        page = await self.get_page(index)
 
         if self.running:
             await self._show_page(page)
@@ -197,7 +212,7 @@ class PaginatorSession:
         """
         Go to the last page.
         """
-        await self.show_page(len(self.pages) - 1)
+        await self.show_page(self.page_count - 1)
 
 
 class EmbedPaginatorSession(PaginatorSession):
@@ -224,6 +239,198 @@ class EmbedPaginatorSession(PaginatorSession):
         await self.base.edit(embed=page)
 
 
+class CursorPageSource:
+    """
+    Lazily loads the entries of a query, one entry per page.
+
+    Only a few entries around the requested one are fetched and formatted at a
+    time, and the number of pages comes from a separate count.
+
+    Parameters
+    ----------
+    collection : Union[AsyncIOMotorCollection, List[AsyncIOMotorCollection]]
+        The collection to query, or several collections whose entries are shown
+        one after the other.
+    query : dict
+        The query filter.
+    format_entry : Callable[[dict, int], Any]
+        Formats an entry into a page, it also gets the total number of entries.
+    projection : dict, optional
+        The fields to fetch.
+    sort : List[Tuple[str, int]], optional
+        The sort order of the entries.
+    limit : int, optional
+        The maximum number of entries.
+    prefetch : int
+        How many entries to fetch on each side of the requested one.
+    """
+
+    def __init__(
+        self,
+        collection,
+        query: dict,
+        format_entry: typing.Callable[[dict, int], typing.Any],
+        *,
+        projection: dict = None,
+        sort: typing.List[typing.Tuple[str, int]] = None,
+        limit: int = None,
+        prefetch: int = 2,
+    ):
+        if not isinstance(collection, (list, tuple)):
+            collection = [collection]
+        self.collections = collection
+        self.query = query
+        self.format_entry = format_entry
+        self.projection = projection
+        self.sort = sort
+        self.limit = limit
+        self.prefetch = prefetch
+        self.total = None
+        self._counts = []
+        # page number -> formatted page, only the pages around the current one are kept
+        self._pages = {}
+
+    async def count(self) -> int:
+        if self.total is None:
+            remaining = self.limit
+            for collection in self.collections:
+                if remaining is None:
+                    count = await collection.count_documents(self.query)
+                elif remaining > 0:
+                    count = await collection.count_documents(self.query, limit=remaining)
+                    remaining -= count
+                else:
+                    count = 0
+                self._counts.append(count)
+            self.total = sum(self._counts)
+        return self.total
+
+    async def get_page(self, index: int) -> typing.Any:
+        if index not in self._pages:
+            total = await self.count()
+            # the window is fetched from the collection the page belongs to
+            first = 0
+            for collection, count in zip(self.collections, self._counts):
+                if index < first + count:
+                    break
+                first += count
+            start = max(index - self.prefetch, first)
+            cursor = collection.find(self.query, self.projection)
+            if self.sort is not None:
+                cursor = cursor.sort(self.sort)
+            cursor = cursor.skip(start - first).limit(
+                min(2 * self.prefetch + 1, first + count - start)
+            )
+
+            self._pages = {
+                i: page
+                for i, page in self._pages.items()
+                if abs(i - index) <= 2 * self.prefetch + 1
+            }
+            i = start
+            async for entry in cursor:
+                self._pages[i] = self.format_entry(entry, total)
+                i += 1
+        return self._pages[index]
+
+
+class SearchPageSource:
+    """
+    Lazily loads the results of a `SearchIndex` search, a few per page.
+
+    Pages are fetched with the cursor of the previous one when it was seen,
+    otherwise by offset.
+
+    Parameters
+    ----------
+    index : SearchIndex
+        The search index.
+    text : str
+        The search.
+    format_page : Callable[[List[dict], int, int], Any]
+        Formats the results of a page into a page, it also gets the
+        index of the page and the total number of results.
+    per_page : int
+        The number of results per page.
+    limit : int, optional
+        The maximum number of results.
+    """
+
+    def __init__(
+        self,
+        index,
+        text: str,
+        format_page: typing.Callable[[typing.List[dict], int, int], typing.Any],
+        *,
+        per_page: int = 5,
+        limit: int = None,
+    ):
+        self.index = index
+        self.text = text
+        self.format_page = format_page
+        self.per_page = per_page
+        self.limit = limit
+        self.results = None
+        self.total = None
+        # page number -> cursor of the next page
+        self._cursors = {}
+
+    async def count(self) -> int:
+        if self.total is None:
+            self.results = await self.index.count(self.text)
+            if self.limit:
+                self.results = min(self.results, self.limit)
+            self.total = -(-self.results // self.per_page)
+        return self.total
+
+    async def get_page(self, index: int) -> typing.Any:
+        await self.count()
+        results, cursor = await self.index.search(
+            self.text,
+            limit=self.per_page,
+            after=self._cursors.get(index - 1),
+            offset=index * self.per_page,
+        )
+        self._cursors[index] = cursor
+        results = results[: self.results - index * self.per_page]
+        return self.format_page(results, index, self.results)
+
+
+class LazyEmbedPaginatorSession(EmbedPaginatorSession):
+    """
+    Paginates embeds that are loaded from a `CursorPageSource` as they are shown.
+
+    Parameters
+    ----------
+    ctx : Context
+        The context of the command.
+    source : Union[CursorPageSource, SearchPageSource]
+        Where the embeds come from, `count()` must have been awaited.
+    """
+
+    def __init__(self, ctx: commands.Context, source, **options):
+        super().__init__(ctx, **options)
+        self.source = source
+
+    def add_page(self, item: Embed) -> None:
+        raise TypeError("Pages are loaded from the source.")
+
+    @property
+    def page_count(self) -> int:
+        return self.source.total
+
+    async def get_page(self, index: int) -> Embed:
+        embed = await self.source.get_page(index)
+        if self.page_count > 1:
+            # the source keeps the original, which can be shown again
+            embed = embed.copy()
+            footer_text = f"Pagina {index + 1} di {self.page_count}"
+            if embed.footer.text:
+                footer_text = footer_text + " • " + embed.footer.text
+            embed.set_footer(text=footer_text, icon_url=embed.footer.icon_url)
+        return embed
+
+
 class MessagePaginatorSession(PaginatorSession):
     def __init__(self, ctx: commands.Context, *messages, embed: Embed = None, **options):
         self.embed = embed
@@ -0,0 +1,174 @@
+import asyncio
+import heapq
+import itertools
+import typing
+from collections import Counter
+from datetime import datetime
+
+from core.models import getLogger
+
+logger = getLogger(__name__)
+
+
+class Scheduler:
+    """
+    Runs timed jobs (thread closures, timed unblocks...) from a single task.
+
+    Jobs are kept in a min-heap ordered by due time and persisted in the
+    `jobs` collection, so they survive restarts and are restored with a
+    single query. Each job has a unique `key` (e.g. "close:<recipient id>"),
+    scheduling a job with an existing key replaces it.
+
+    Parameters
+    ----------
+    bot : Bot
+        The Modmail bot.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        # key -> job
+        self._jobs = {}
+        # (due, seq, key, job), entries whose job was replaced or cancelled are skipped
+        self._heap = []
+        self._seq = itertools.count()
+        self._handlers = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._loaded = False
+        # number of jobs run and how late they were, in seconds
+        self.dispatched = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def __len__(self):
+        return len(self._jobs)
+
+    @property
+    def collection(self):
+        return self.bot.db.jobs
+
+    def register(self, kind: str, handler: typing.Callable[[dict], typing.Awaitable]) -> None:
+        """Sets the coroutine function that runs the jobs of a kind."""
+        self._handlers[kind] = handler
+
+    def get(self, key: str) -> typing.Optional[dict]:
+        return self._jobs.get(key)
+
+    def _push(self, job: dict) -> None:
+        self._jobs[job["key"]] = job
+        heapq.heappush(self._heap, (job["due"], next(self._seq), job["key"], job))
+        if self._heap[0][3] is job:
+            self._wakeup.set()
+        if len(self._heap) > 2 * len(self._jobs) + 64:
+            self._compact()
+
+    def _compact(self) -> None:
+        self._heap = [entry for entry in self._heap if self._jobs.get(entry[2]) is entry[3]]
+        heapq.heapify(self._heap)
+
+    async def load(self) -> None:
+        """
+        Restores the pending jobs from the database.
+
+        Only the first call loads them, the bot calls it on every (re)connection
+        and the jobs in memory are already up to date, some may be running.
+        """
+        if self._loaded:
+            return
+        async for job in self.collection.find({}, {"_id": 0}):
+            if job["key"] in self._jobs:
+                # scheduled again before loading, the job in memory is newer
+                continue
+            self._jobs[job["key"]] = job
+            self._heap.append((job["due"], next(self._seq), job["key"], job))
+        heapq.heapify(self._heap)
+        self._loaded = True
+        self._wakeup.set()
+        logger.debug("Caricate %d operazioni programmate.", len(self._jobs))
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = self.bot.loop.create_task(self._run())
+
+    async def schedule(self, kind: str, key: str, due: datetime, data: dict = None) -> dict:
+        """
+        Schedules a job, replacing the pending job with the same key.
+
+        Parameters
+        ----------
+        kind : str
+            The kind of job, selects the handler.
+        key : str
+            Unique key of the job.
+        due : datetime
+            When the job should run (UTC).
+        data : dict, optional
+            Passed to the handler with the job.
+        """
+        job = {"key": key, "kind": kind, "due": due, "data": data or {}}
+        self._push(job)
+        await self.collection.update_one({"key": key}, {"$set": job}, upsert=True)
+        return job
+
+    async def cancel(self, key: str) -> typing.Optional[dict]:
+        """Cancels a pending job, returns it if there was one."""
+        job = self._jobs.pop(key, None)
+        if job is not None:
+            await self.collection.delete_one({"key": key})
+        return job
+
+    def stats(self) -> dict:
+        now = datetime.utcnow()
+        overdue = sum(1 for job in self._jobs.values() if job["due"] <= now)
+        next_due = min((job["due"] for job in self._jobs.values()), default=None)
+        return {
+            "pending": len(self._jobs),
+            "overdue": overdue,
+            "kinds": Counter(job["kind"] for job in self._jobs.values()),
+            "next_due": next_due,
+            "dispatched": self.dispatched,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            timeout = None
+            now = datetime.utcnow()
+            while self._heap:
+                due, _, key, job = self._heap[0]
+                if self._jobs.get(key) is not job:
+                    heapq.heappop(self._heap)
+                    continue
+                if due > now:
+                    timeout = (due - now).total_seconds()
+                    break
+                heapq.heappop(self._heap)
+                del self._jobs[key]
+                self._dispatch(job, now)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, job: dict, now: datetime) -> None:
+        lag = (now - job["due"]).total_seconds()
+        self.dispatched += 1
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.bot.loop.create_task(self._execute(job))
+
+    async def _execute(self, job: dict) -> None:
+        handler = self._handlers.get(job["kind"])
+        try:
+            if handler is None:
+                logger.warning("Nessun gestore per l'operazione %s.", job["key"])
+            else:
+                await handler(job)
+        except Exception:
+            logger.error("L'operazione %s non è riuscita.", job["key"], exc_info=True)
+        finally:
+            # a newer job with the same key may have been scheduled meanwhile
+            await self.collection.delete_one({"key": job["key"], "due": job["due"]})
@@ -0,0 +1,266 @@
+import asyncio
+import re
+import sqlite3
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from core.models import getLogger
+
+logger = getLogger(__name__)
+
+# (score, message id) of the last result of a page, the next page starts after it
+SearchCursor = typing.Tuple[float, int]
+
+
+def match_query(text: str) -> str:
+    """
+    Turns a search typed by a user into an FTS5 query.
+
+    Quoted phrases are kept, every other word must be in the message too and
+    a word ending with `*` matches the words starting with it.
+    """
+    parts = []
+    for token in re.findall(r'"[^"]*"?|\S+', text):
+        prefix = token.endswith("*") and not token.startswith('"')
+        word = token.strip('"').rstrip("*").replace('"', '""')
+        if word.strip():
+            parts.append(f'"{word}"' + ("*" if prefix else ""))
+    if not parts:
+        raise ValueError("La ricerca è vuota.")
+    return " ".join(parts)
+
+
+class SearchIndex:
+    """
+    A full-text index of the log messages, in a local SQLite file using FTS5.
+
+    It is fed by the log worker after each batch of messages is written and
+    kept apart from the main database, so searching never loads it. Writes are
+    queued to a dedicated thread and never awaited by the append path, searches
+    run on another thread with their own connection (the file is in WAL mode).
+
+    Parameters
+    ----------
+    path : str
+        The index file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-writer")
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-reader")
+        # messages added since the bot started and the duration of the last search, in ms
+        self.indexed = 0
+        self.last_search_time = 0.0
+        self._writer.submit(self._setup).result()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _setup(self) -> None:
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5("
+                "content, author, channel_id UNINDEXED, timestamp UNINDEXED, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS logs "
+                "(channel_id INTEGER PRIMARY KEY, key TEXT NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    def _submit(self, func: typing.Callable, *args) -> None:
+        def run():
+            try:
+                func(*args)
+            except Exception:
+                logger.error("Failed to update the search index.", exc_info=True)
+
+        self._writer.submit(run)
+
+    async def _read(self, func: typing.Callable, *args) -> typing.Any:
+        return await asyncio.get_event_loop().run_in_executor(self._reader, func, *args)
+
+    @staticmethod
+    def _rows(channel_id: typing.Union[int, str], messages: list) -> list:
+        rows = []
+        for message in messages:
+            message_id = str(message.get("message_id", ""))
+            if not message_id.isdigit() or not message.get("content"):
+                continue
+            author = message["author"]
+            rows.append(
+                (
+                    int(message_id),
+                    message["content"],
+                    f"{author['name']}#{author['discriminator']}",
+                    int(channel_id),
+                    str(message.get("timestamp")),
+                )
+            )
+        return rows
+
+    def _insert(self, rows: list) -> None:
+        with self._connection() as connection:
+            # edited or backfilled messages replace their previous version
+            connection.executemany("DELETE FROM messages WHERE rowid = ?", [r[:1] for r in rows])
+            connection.executemany(
+                "INSERT INTO messages (rowid, content, author, channel_id, timestamp) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+        self.indexed += len(rows)
+
+    def add_log(self, channel_id: typing.Union[int, str], key: str) -> None:
+        """Records the key of the log of a thread channel, for the links of the results."""
+        self._submit(self._add_logs, [(int(channel_id), key)])
+
+    def _add_logs(self, logs: list) -> None:
+        with self._connection() as connection:
+            connection.executemany("INSERT OR REPLACE INTO logs VALUES (?, ?)", logs)
+
+    def add_messages(self, batch: typing.List[typing.Tuple[str, dict]]) -> None:
+        """Indexes a batch of (channel id, message) written to the logs."""
+        rows = []
+        for channel_id, message in batch:
+            rows += self._rows(channel_id, [message])
+        if rows:
+            self._submit(self._insert, rows)
+
+    def edit_message(self, message_id: typing.Union[int, str], content: str) -> None:
+        self._submit(self._edit_message, int(message_id), content)
+
+    def _edit_message(self, message_id: int, content: str) -> None:
+        with self._connection() as connection:
+            row = connection.execute(
+                "SELECT author, channel_id, timestamp FROM messages WHERE rowid = ?", (message_id,)
+            ).fetchone()
+        if row is not None:
+            self._insert([(message_id, content, *row)])
+
+    def delete_log(self, key: str) -> None:
+        self._submit(self._delete_log, key)
+
+    def _delete_log(self, key: str) -> None:
+        with self._connection() as connection:
+            for (channel_id,) in connection.execute(
+                "SELECT channel_id FROM logs WHERE key = ?", (key,)
+            ).fetchall():
+                connection.execute("DELETE FROM messages WHERE channel_id = ?", (channel_id,))
+            connection.execute("DELETE FROM logs WHERE key = ?", (key,))
+
+    async def index_log(
+        self, channel_id: typing.Union[int, str], key: str, messages: list
+    ) -> None:
+        """Indexes a whole log, waiting until it is written."""
+
+        def index():
+            self._add_logs([(int(channel_id), key)])
+            self._insert(self._rows(channel_id, messages))
+
+        await asyncio.get_event_loop().run_in_executor(self._writer, index)
+
+    async def get_state(self, name: str) -> typing.Optional[str]:
+        def get():
+            row = (
+                self._connection()
+                .execute("SELECT value FROM state WHERE name = ?", (name,))
+                .fetchone()
+            )
+            return row and row[0]
+
+        return await self._read(get)
+
+    async def set_state(self, name: str, value: str) -> None:
+        def set_():
+            with self._connection() as connection:
+                connection.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (name, value))
+
+        await asyncio.get_event_loop().run_in_executor(self._writer, set_)
+
+    async def count(self, text: str) -> int:
+        """Counts the messages matching a search."""
+        query = match_query(text)
+
+        def count():
+            return (
+                self._connection()
+                .execute("SELECT count(*) FROM messages WHERE messages MATCH ?", (query,))
+                .fetchone()[0]
+            )
+
+        return await self._read(count)
+
+    async def search(
+        self, text: str, *, limit: int = 10, after: SearchCursor = None, offset: int = 0
+    ) -> typing.Tuple[typing.List[dict], typing.Optional[SearchCursor]]:
+        """
+        Searches the messages, best matches (by BM25) first.
+
+        Parameters
+        ----------
+        text : str
+            The search, see `match_query`.
+        limit : int
+            The maximum number of results.
+        after : SearchCursor, optional
+            Where the previous page ended, the results start after it.
+        offset : int
+            The number of results to skip, when there is no cursor.
+
+        Returns
+        -------
+        Tuple[List[dict], Optional[SearchCursor]]
+            The results and the cursor of the next page, `None` if it was the last.
+        """
+        query = match_query(text)
+        sql = (
+            "SELECT * FROM ("
+            "SELECT m.rowid AS message_id, m.channel_id, l.key, m.author, m.timestamp, "
+            "snippet(messages, 0, '**', '**', '…', 16) AS snippet, bm25(messages) AS score "
+            "FROM messages m LEFT JOIN logs l ON l.channel_id = m.channel_id "
+            "WHERE messages MATCH ?)"
+        )
+        params = [query]
+        if after is not None:
+            sql += " WHERE score > ? OR (score = ? AND message_id > ?)"
+            params += [after[0], after[0], after[1]]
+        sql += " ORDER BY score, message_id LIMIT ? OFFSET ?"
+        params += [limit, 0 if after is not None else offset]
+
+        def search():
+            connection = self._connection()
+            connection.row_factory = sqlite3.Row
+            return [dict(row) for row in connection.execute(sql, params)]
+
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        results = await self._read(search)
+        self.last_search_time = (loop.time() - started) * 1000
+
+        cursor = None
+        if len(results) == limit:
+            cursor = (results[-1]["score"], results[-1]["message_id"])
+        return results, cursor
+
+    def close(self) -> None:
+        for executor in (self._writer, self._reader):
+
+            def close():
+                connection = getattr(self._local, "connection", None)
+                if connection is not None:
+                    connection.close()
+                    self._local.connection = None
+
+            executor.submit(close).result()
+            executor.shutdown()
@@ -0,0 +1,343 @@
+import csv
+import io
+import statistics
+import typing
+from bisect import bisect_right
+from collections import Counter
+from datetime import datetime, timedelta
+
+from core.models import getLogger
+from core.utils import parse_timestamp
+
+try:
+    import numpy as np
+except ImportError:
+    # the reports are computed in plain Python, slower on long periods
+    np = None
+
+logger = getLogger(__name__)
+
+# the fields of a closed log folded into its rollup
+LOG_ROLLUP_PROJECTION = {
+    "_id": 0,
+    "created_at": 1,
+    "closed_at": 1,
+    "close_message": 1,
+    "closer.id": 1,
+    "responders": 1,
+    "metrics": 1,
+}
+
+# close messages kept per day, the others are only counted
+ROLLUP_CLOSE_REASONS = 10
+
+# the percentiles of the response times and durations in the reports
+STATS_PERCENTILES = (50, 90, 95)
+
+MESSAGE_ROLES = ("user", "staff", "internal", "system")
+
+# the lower bounds of the buckets the response times and durations are counted in,
+# in seconds: 30s, 1m, 2m, 5m, 10m, 15m, 30m, 1h, 2h, 4h, 8h, 12h, 1d, 2d, 3d, 1w, 2w, 30d
+TIME_BUCKETS = (
+    0,
+    30,
+    60,
+    120,
+    300,
+    600,
+    900,
+    1800,
+    3600,
+    7200,
+    14400,
+    28800,
+    43200,
+    86400,
+    172800,
+    259200,
+    604800,
+    1209600,
+    2592000,
+)
+
+
+def day_start(value: datetime) -> datetime:
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def summarize_times(values: typing.List[float]) -> dict:
+    """
+    Sums up some times in seconds: their count, sum, maximum and a histogram
+    of `TIME_BUCKETS`, so the size does not depend on how many there are.
+    """
+    histogram = [0] * len(TIME_BUCKETS)
+    for value in values:
+        histogram[bisect_right(TIME_BUCKETS, value) - 1] += 1
+    return {
+        "count": len(values),
+        "sum": float(sum(values)),
+        "max": float(max(values, default=0)),
+        "histogram": histogram,
+    }
+
+
+def rollup_day(guild_id: typing.Union[int, str], day: datetime, logs: typing.List[dict]) -> dict:
+    """
+    Folds the logs closed on a day into its rollup document.
+
+    Parameters
+    ----------
+    guild_id : Union[int, str]
+        The guild of the logs.
+    day : datetime
+        The start of the day (UTC).
+    logs : List[dict]
+        The logs closed that day, with the fields of `LOG_ROLLUP_PROJECTION`.
+
+    Returns
+    -------
+    dict
+        The number of threads and of threads with a staff reply, the messages
+        by role, the threads closed and replied to by each moderator, the
+        most common close messages, and the response times and durations of
+        the threads, see `summarize_times`.
+    """
+    messages = Counter()
+    moderators = {}
+    reasons = Counter()
+    response_times = []
+    durations = []
+    responded = 0
+
+    for log in logs:
+        metrics = log.get("metrics", {})
+        messages.update(metrics.get("messages", {}))
+
+        first_message = parse_timestamp(metrics.get("first_message_at"))
+        first_response = parse_timestamp(metrics.get("first_response_at"))
+        if first_response is not None:
+            responded += 1
+            if first_message is not None:
+                response_times.append(max((first_response - first_message).total_seconds(), 0))
+        if log.get("created_at") is not None:
+            duration = parse_timestamp(log["closed_at"]) - parse_timestamp(log["created_at"])
+            durations.append(max(duration.total_seconds(), 0))
+
+        closer_id = (log.get("closer") or {}).get("id")
+        if closer_id is not None:
+            moderators.setdefault(closer_id, {"closed": 0, "responded": 0})["closed"] += 1
+        for responder_id in log.get("responders", []):
+            moderators.setdefault(responder_id, {"closed": 0, "responded": 0})["responded"] += 1
+
+        reason = (log.get("close_message") or "").strip()[:100]
+        reasons[reason or None] += 1
+
+    close_reasons = reasons.most_common(ROLLUP_CLOSE_REASONS)
+    return {
+        "_id": f"{guild_id}:{day:%Y-%m-%d}",
+        "guild_id": str(guild_id),
+        "date": day,
+        "threads": len(logs),
+        "responded": responded,
+        "messages": dict(messages),
+        "moderators": moderators,
+        "close_reasons": [{"reason": reason, "count": count} for reason, count in close_reasons],
+        "other_close_reasons": sum(reasons.values()) - sum(c for _, c in close_reasons),
+        "response_times": summarize_times(response_times),
+        "durations": summarize_times(durations),
+        "rolled_up_at": datetime.utcnow(),
+    }
+
+
+def _array(values: list, dtype=None):
+    """The values as a NumPy array, or left as a list without NumPy."""
+    return values if np is None else np.asarray(values, dtype=dtype)
+
+
+def _sum(values) -> float:
+    return sum(values) if np is None else values.sum()
+
+
+def histogram_percentiles(histogram, maximum: float) -> typing.List[float]:
+    """
+    The `STATS_PERCENTILES` of the times counted in a histogram of `TIME_BUCKETS`.
+
+    They are interpolated linearly inside the bucket they fall in, the last
+    bucket with times ends at `maximum`, the largest of them.
+    """
+    if np is not None:
+        histogram = np.asarray(histogram)
+        cumulative = np.cumsum(histogram)
+        lower = np.asarray(TIME_BUCKETS, dtype=float)
+        upper = np.minimum(np.append(lower[1:], np.inf), maximum)
+        targets = np.asarray(STATS_PERCENTILES) / 100 * cumulative[-1]
+        buckets = np.searchsorted(cumulative, targets)
+        before = cumulative[buckets] - histogram[buckets]
+        fraction = (targets - before) / histogram[buckets]
+        values = lower[buckets] + fraction * np.maximum(upper[buckets] - lower[buckets], 0)
+        return values.tolist()
+
+    total = sum(histogram)
+    values = []
+    for p in STATS_PERCENTILES:
+        target = p / 100 * total
+        before = 0
+        for bucket, count in enumerate(histogram):
+            if count and before + count >= target:
+                break
+            before += count
+        lower = TIME_BUCKETS[bucket]
+        upper = TIME_BUCKETS[bucket + 1] if bucket + 1 < len(TIME_BUCKETS) else float("inf")
+        upper = min(upper, maximum)
+        values.append(lower + (target - before) / count * max(upper - lower, 0))
+    return values
+
+
+class TimeSummary:
+    """
+    The response times or durations of the days of a report, from the
+    summaries of `summarize_times`, with one row per day.
+
+    Parameters
+    ----------
+    summaries : List[dict]
+        The summary of each day.
+    """
+
+    def __init__(self, summaries: typing.List[dict]):
+        self.counts = _array([summary["count"] for summary in summaries])
+        self.sums = _array([summary["sum"] for summary in summaries], float)
+        self.maxima = _array([summary["max"] for summary in summaries], float)
+        self.histograms = _array([summary["histogram"] for summary in summaries])
+
+    def mean(self, day: int = None) -> typing.Optional[float]:
+        """The mean of a day or of all the days, `None` if there are no times."""
+        days = slice(None) if day is None else slice(day, day + 1)
+        count = _sum(self.counts[days])
+        if not count:
+            return None
+        return float(_sum(self.sums[days]) / count)
+
+    def percentiles(self, day: int = None) -> typing.Optional[typing.List[float]]:
+        """The `STATS_PERCENTILES` of a day or of all the days, `None` if there are no times."""
+        days = slice(None) if day is None else slice(day, day + 1)
+        if not _sum(self.counts[days]):
+            return None
+        if np is None:
+            histogram = [sum(counts) for counts in zip(*self.histograms[days])]
+        else:
+            histogram = self.histograms[days].sum(axis=0)
+        return histogram_percentiles(histogram, max(self.maxima[days]))
+
+
+class StatsReport:
+    """
+    Sums up the daily rollups of a period.
+
+    The days are laid out as NumPy arrays, or as lists if NumPy is not
+    installed. The days without rollup count as zero.
+
+    Parameters
+    ----------
+    rollups : List[dict]
+        The rollups of the period, see `rollup_day`.
+    start : datetime
+        The first day of the period (UTC).
+    end : datetime
+        The day after the period (UTC).
+    """
+
+    def __init__(self, rollups: typing.List[dict], start: datetime, end: datetime):
+        self.start = day_start(start)
+        self.end = day_start(end)
+        days = max((self.end - self.start).days, 0)
+        self.dates = [self.start + timedelta(days=i) for i in range(days)]
+
+        threads = [0] * days
+        responded = [0] * days
+        messages = {role: [0] * days for role in MESSAGE_ROLES}
+        response_times = [summarize_times([])] * days
+        durations = [summarize_times([])] * days
+        self.moderators = Counter()
+        self.moderator_replies = Counter()
+        self.close_reasons = Counter()
+        self.other_close_reasons = 0
+
+        for rollup in rollups:
+            i = (day_start(rollup["date"]) - self.start).days
+            if not 0 <= i < days:
+                continue
+            threads[i] = rollup["threads"]
+            responded[i] = rollup["responded"]
+            for role, count in rollup["messages"].items():
+                messages.setdefault(role, [0] * days)[i] = count
+            response_times[i] = rollup["response_times"]
+            durations[i] = rollup["durations"]
+            for moderator_id, counts in rollup["moderators"].items():
+                self.moderators[moderator_id] += counts["closed"]
+                self.moderator_replies[moderator_id] += counts["responded"]
+            for entry in rollup["close_reasons"]:
+                self.close_reasons[entry["reason"]] += entry["count"]
+            self.other_close_reasons += rollup["other_close_reasons"]
+
+        self.threads = _array(threads)
+        self.responded = _array(responded)
+        self.messages = {role: _array(counts) for role, counts in messages.items()}
+        self.response_times = TimeSummary(response_times)
+        self.durations = TimeSummary(durations)
+
+    @property
+    def days(self) -> int:
+        return len(self.dates)
+
+    @property
+    def trend(self) -> float:
+        """How many threads per day the number of threads grows by, from a linear fit."""
+        if self.days < 2 or not any(self.threads):
+            return 0.0
+        if np is not None:
+            slope, _ = np.polyfit(np.arange(self.days), self.threads, 1)
+            return float(slope)
+        mean_day, mean_threads = (self.days - 1) / 2, statistics.mean(self.threads)
+        covariance = sum((i - mean_day) * (t - mean_threads) for i, t in enumerate(self.threads))
+        return covariance / sum((i - mean_day) ** 2 for i in range(self.days))
+
+    def weekly_change(self) -> typing.Optional[float]:
+        """
+        The change of the threads of the last 7 days from the 7 before,
+        as a fraction, `None` if there are not enough days or threads.
+        """
+        if self.days < 14:
+            return None
+        last, previous = _sum(self.threads[-7:]), _sum(self.threads[-14:-7])
+        if not previous:
+            return None
+        return float(last - previous) / previous
+
+    def to_csv(self) -> str:
+        """One row per day, with the means and percentiles of the response times and durations."""
+        output = io.StringIO()
+        writer = csv.writer(output)
+        roles = list(self.messages)
+        columns = ["mean", *(f"p{p}" for p in STATS_PERCENTILES)]
+        writer.writerow(
+            [
+                "date",
+                "threads",
+                "responded",
+                *(f"messages_{role}" for role in roles),
+                *(f"response_time_{column}" for column in columns),
+                *(f"duration_{column}" for column in columns),
+            ]
+        )
+        for i, date in enumerate(self.dates):
+            row = [f"{date:%Y-%m-%d}", int(self.threads[i]), int(self.responded[i])]
+            row += [int(self.messages[role][i]) for role in roles]
+            for summary in (self.response_times, self.durations):
+                mean = summary.mean(i)
+                if mean is None:
+                    row += [""] * len(columns)
+                else:
+                    row += [f"{value:.0f}" for value in (mean, *summary.percentiles(i))]
+            writer.writerow(row)
+        return output.getvalue()
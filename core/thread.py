@@ -15,6 +15,11 @@ from core.utils import is_image_url, days, match_user_id, truncate, format_chann
 
 logger = getLogger(__name__)
 
+# how stale the persisted auto close deadline may get before it is rewritten
+AUTO_CLOSE_FLUSH_INTERVAL = timedelta(minutes=5)
+# how many threads may rebuild their message links at the same time
+MESSAGE_LINK_BACKFILLS = 3
+
 
 class Thread:
     """Represents a discord Modmail thread"""
@@ -38,8 +43,8 @@ class Thread:
         self._channel = channel
         self.genesis_message = None
         self._ready_event = asyncio.Event()
-        self.close_task = None
-        self.auto_close_task = None
+        # last message sent or received, the auto close deadline is derived from it
+        self.last_activity = None
 
     def __repr__(self):
         return f'Stanza(recipient="{self.recipient or self.id}", channel={self.channel.id})'
@@ -56,6 +61,16 @@ class Thread:
     def id(self) -> int:
         return self._id
 
+    @property
+    def close_task(self) -> typing.Optional[dict]:
+        """The scheduled close job, if any."""
+        return self.bot.scheduler.get(f"close:{self.id}")
+
+    @property
+    def auto_close_task(self) -> typing.Optional[dict]:
+        """The scheduled auto close job, if any."""
+        return self.bot.scheduler.get(f"auto_close:{self.id}")
+
     @property
     def channel(self) -> typing.Union[discord.TextChannel, discord.DMChannel]:
         return self._channel
@@ -100,7 +115,7 @@ class Thread:
             )
         except discord.HTTPException as e:  # Failed to create due to missing perms.
             logger.critical("Non è stato possibile creare la stanza.", exc_info=True)
-            self.manager.cache.pop(self.id)
+            self.manager.unregister(self)
 
             embed = discord.Embed(color=self.bot.error_color)
             embed.title = "Non è stato possibile creare la stanza."
@@ -112,14 +127,13 @@ class Thread:
             return
 
         self._channel = channel
+        self.manager.register(self)
 
         try:
-            log_url, log_data = await asyncio.gather(
+            log_url, log_count = await asyncio.gather(
                 self.bot.api.create_log_entry(recipient, channel, creator or recipient),
-                self.bot.api.get_user_logs(recipient.id),
+                self.bot.api.count_user_logs(recipient.id),
             )
-
-            log_count = sum(1 for log in log_data if not log["open"])
         except Exception:
             logger.error("Non è stato possibile mettere il log nel database.", exc_info=True)
             log_url = log_count = None
@@ -251,11 +265,6 @@ class Thread:
 
         return embed
 
-    def _close_after(self, closer, silent, delete_channel, message):
-        return self.bot.loop.create_task(
-            self._close(closer, silent, delete_channel, message, True)
-        )
-
     async def close(
         self,
         *,
@@ -268,33 +277,22 @@ class Thread:
     ) -> None:
         """Close a thread now or after a set time in seconds"""
 
-        # restarts the after timer
-        await self.cancel_closure(auto_close)
-
+        # scheduling replaces the pending job of the same kind,
+        # closing now cancels every pending job
         if after > 0:
-            # TODO: Add somewhere to clean up broken closures
-            #  (when channel is already deleted)
-            now = datetime.utcnow()
-            items = {
-                # 'initiation_time': now.isoformat(),
-                "time": (now + timedelta(seconds=after)).isoformat(),
-                "closer_id": closer.id,
-                "silent": silent,
-                "delete_channel": delete_channel,
-                "message": message,
-                "auto_close": auto_close,
-            }
-            self.bot.config["closures"][str(self.id)] = items
-            await self.bot.config.update()
-
-            task = self.bot.loop.call_later(
-                after, self._close_after, closer, silent, delete_channel, message
+            kind = "auto_close" if auto_close else "close"
+            await self.bot.scheduler.schedule(
+                kind,
+                f"{kind}:{self.id}",
+                datetime.utcnow() + timedelta(seconds=after),
+                {
+                    "recipient_id": self.id,
+                    "closer_id": closer.id,
+                    "silent": silent,
+                    "delete_channel": delete_channel,
+                    "message": message,
+                },
             )
-
-            if auto_close:
-                self.auto_close_task = task
-            else:
-                self.close_task = task
         else:
             await self._close(closer, silent, delete_channel, message)
 
@@ -302,7 +300,7 @@ class Thread:
         self, closer, silent=False, delete_channel=True, message=None, scheduled=False
     ):
         try:
-            self.manager.cache.pop(self.id)
+            self.manager.unregister(self)
         except KeyError as e:
             logger.error("Stanza già chiusa: %s.", e)
             return
@@ -311,15 +309,16 @@ class Thread:
 
         # Cancel auto closing the thread if closed by any means.
 
-        self.bot.config["subscriptions"].pop(str(self.id), None)
-        self.bot.config["notification_squad"].pop(str(self.id), None)
+        self.bot.loop.create_task(self.bot.api.delete_message_links(self.channel.id))
+
+        await self.manager.delete_state(self.id)
 
         # Logging
         log_data = await self.bot.api.post_log(
             self.channel.id,
             {
                 "open": False,
-                "closed_at": str(datetime.utcnow()),
+                "closed_at": datetime.utcnow(),
                 "close_message": message if not silent else None,
                 "closer": {
                     "id": str(closer.id),
@@ -403,17 +402,18 @@ class Thread:
 
         await asyncio.gather(*tasks)
 
+    def auto_close_deadline(self) -> typing.Optional[datetime]:
+        """When the thread should be closed for inactivity, `None` if unknown."""
+        timeout = self.bot.config.get("thread_auto_close")
+        if self.last_activity is None or timeout == isodate.Duration():
+            return None
+        return self.last_activity + timedelta(seconds=timeout.total_seconds())
+
     async def cancel_closure(self, auto_close: bool = False, all: bool = False) -> None:
-        if self.close_task is not None and (not auto_close or all):
-            self.close_task.cancel()
-            self.close_task = None
-        if self.auto_close_task is not None and (auto_close or all):
-            self.auto_close_task.cancel()
-            self.auto_close_task = None
-
-        to_update = self.bot.config["closures"].pop(str(self.id), None)
-        if to_update is not None:
-            await self.bot.config.update()
+        if not auto_close or all:
+            await self.bot.scheduler.cancel(f"close:{self.id}")
+        if auto_close or all:
+            await self.bot.scheduler.cancel(f"auto_close:{self.id}")
 
     async def _restart_close_timer(self):
         """
@@ -429,7 +429,17 @@ class Thread:
         # Set timeout seconds
         seconds = timeout.total_seconds()
         # seconds = 20  # Uncomment to debug with just 20 seconds
-        reset_time = datetime.utcnow() + timedelta(seconds=seconds)
+        now = datetime.utcnow()
+        self.last_activity = now
+        reset_time = now + timedelta(seconds=seconds)
+
+        # The pending job is re-armed when it fires before the real deadline,
+        # it is only rewritten once it gets too stale.
+        job = self.auto_close_task
+        flush_interval = min(AUTO_CLOSE_FLUSH_INTERVAL, timedelta(seconds=seconds / 4))
+        if job is not None and reset_time - job["due"] < flush_interval:
+            return
+
         human_time = human_timedelta(dt=reset_time)
 
         if self.bot.config.get("thread_auto_close_silently"):
@@ -469,70 +479,45 @@ class Thread:
                 or message1.author != self.bot.user
             ):
                 raise ValueError("Messaggio della stanza non valido.")
+            link = await self.bot.api.get_message_link(message1.id)
+            message_id = message1.id
 
         elif message_id is not None:
+            link = await self.bot.api.get_message_link(message_id)
+        else:
+            kinds = ["thread_message", "anonymous"]
+            if either_direction:
+                kinds.append("recipient")
+            link = await self.bot.api.get_last_message_link(self.channel.id, kinds)
+
+        if (
+            link is None
+            or link["channel_id"] != self.channel.id
+            or (message_id is not None and link["thread_message_id"] != int(message_id))
+        ):
+            raise ValueError("Messaggio della stanza non trovato.")
+
+        if link["kind"] == "note" and not note:
+            raise ValueError("Messaggio della stanza non trovato.")
+        if link["kind"] == "recipient" and not either_direction:
+            if message1 is not None:
+                raise ValueError("Messaggio privato non trovato.")
+            raise ValueError("Messaggio della stanza non trovato.")
+
+        if message1 is None:
             try:
-                message1 = await self.channel.fetch_message(message_id)
+                message1 = await self.channel.fetch_message(link["thread_message_id"])
             except discord.NotFound:
                 raise ValueError("Messaggio della stanza non trovato.")
 
-            if not (
-                message1.embeds
-                and message1.embeds[0].author.url
-                and message1.embeds[0].color
-                and message1.author == self.bot.user
-            ):
-                raise ValueError("Messaggio della stanza non trovato.")
-
-            if message1.embeds[0].color.value == self.bot.main_color and message1.embeds[
-                0
-            ].author.name.startswith("Nota"):
-                if not note:
-                    raise ValueError("Messaggio della stanza non trovato.")
-                return message1, None
-
-            if message1.embeds[0].color.value != self.bot.mod_color and not (
-                either_direction and message1.embeds[0].color.value == self.bot.recipient_color
-            ):
-                raise ValueError("Messaggio della stanza non trovato.")
-        else:
-            async for message1 in self.channel.history():
-                if (
-                    message1.embeds
-                    and message1.embeds[0].author.url
-                    and message1.embeds[0].color
-                    and (
-                        message1.embeds[0].color.value == self.bot.mod_color
-                        or (
-                            either_direction
-                            and message1.embeds[0].color.value == self.bot.recipient_color
-                        )
-                    )
-                    and message1.embeds[0].author.url.split("#")[-1].isdigit()
-                    and message1.author == self.bot.user
-                ):
-                    break
-            else:
-                raise ValueError("Messaggio della stanza non trovato.")
+        if link["dm_message_id"] is None:
+            return message1, None
 
         try:
-            joint_id = int(message1.embeds[0].author.url.split("#")[-1])
-        except ValueError:
-            raise ValueError("Messaggio della stanza non valido.")
-
-        async for msg in self.recipient.history():
-            if either_direction:
-                if msg.id == joint_id:
-                    return message1, msg
-
-            if not (msg.embeds and msg.embeds[0].author.url):
-                continue
-            try:
-                if int(msg.embeds[0].author.url.split("#")[-1]) == joint_id:
-                    return message1, msg
-            except ValueError:
-                continue
-        raise ValueError("Messaggio privato non trovato.")
+            message2 = await self.recipient.fetch_message(link["dm_message_id"])
+        except discord.NotFound:
+            raise ValueError("Messaggio privato non trovato.")
+        return message1, message2
 
     async def edit_message(self, message_id: typing.Optional[int], message: str) -> None:
         try:
@@ -568,27 +553,75 @@ class Thread:
             await asyncio.gather(*tasks)
 
     async def find_linked_message_from_dm(self, message, either_direction=False):
-        if either_direction and message.embeds:
-            compare_url = message.embeds[0].author.url
-        else:
-            compare_url = None
+        link = await self.bot.api.get_message_link(message.id)
+        if (
+            link is None
+            or link["channel_id"] != self.channel.id
+            or link["dm_message_id"] != message.id
+            or (link["kind"] != "recipient" and not either_direction)
+        ):
+            raise ValueError("Il messaggio del canale della stanza non è stato trovato.")
 
-        async for linked_message in self.channel.history():
-            if not linked_message.embeds:
+        try:
+            return await self.channel.fetch_message(link["thread_message_id"])
+        except discord.NotFound:
+            raise ValueError("Il messaggio del canale della stanza non è stato trovato.")
+
+    async def backfill_message_links(self) -> int:
+        """
+        Rebuilds the message links of a thread that was opened before they
+        were stored, by pairing the embeds in the thread channel and the DMs once.
+        """
+        thread_messages = {}
+        async for message in self.channel.history(limit=None):
+            if message.author != self.bot.user or not message.embeds:
                 continue
-            url = linked_message.embeds[0].author.url
-            if not url:
+            embed = message.embeds[0]
+            url = embed.author.url
+            if not url or not embed.color or not url.split("#")[-1].isdigit():
                 continue
-            if url == compare_url:
-                return linked_message
+            joint_id = int(url.split("#")[-1])
+            author_id = url.split("#")[0].split("/")[-1]
+            author_id = int(author_id) if author_id.isdigit() else self.id
+
+            if embed.color.value == self.bot.main_color:
+                kind = "note"
+            elif embed.color.value == self.bot.recipient_color:
+                kind = "recipient"
+            elif embed.footer.text == "Risposta anonima":
+                kind = "anonymous"
+            else:
+                kind = "thread_message"
+            thread_messages[joint_id] = (message.id, author_id, kind)
+
+        dm_messages = {}
+        async for message in self.recipient.history(limit=None):
+            if message.author == self.bot.user:
+                if not message.embeds or not message.embeds[0].author.url:
+                    continue
+                joint_id = message.embeds[0].author.url.split("#")[-1]
+                if joint_id.isdigit():
+                    dm_messages[int(joint_id)] = message.id
+            else:
+                dm_messages[message.id] = message.id
 
-            msg_id = url.split("#")[-1]
-            if not msg_id.isdigit():
+        tasks = []
+        for joint_id, (message_id, author_id, kind) in thread_messages.items():
+            dm_message_id = dm_messages.get(joint_id)
+            if dm_message_id is None and kind != "note":
                 continue
-            msg_id = int(msg_id)
-            if int(msg_id) == message.id:
-                return linked_message
-        raise ValueError("Il messaggio del canale della stanza non è stato trovato.")
+            tasks.append(
+                self.bot.api.add_message_link(
+                    self.channel.id,
+                    message_id,
+                    dm_message_id,
+                    recipient_id=self.id,
+                    author_id=author_id,
+                    kind=kind,
+                )
+            )
+        await asyncio.gather(*tasks)
+        return len(tasks)
 
     async def edit_dm_message(self, message: discord.Message, content: str) -> None:
         try:
@@ -616,6 +649,15 @@ class Thread:
                 message, message_id=msg.id, channel_id=self.channel.id, type_="system"
             )
         )
+        self.bot.loop.create_task(
+            self.bot.api.add_message_link(
+                self.channel.id,
+                msg.id,
+                recipient_id=self.id,
+                author_id=message.author.id,
+                kind="note",
+            )
+        )
 
         return msg
 
@@ -634,7 +676,7 @@ class Thread:
         tasks = []
 
         try:
-            await self.send(
+            dm_msg = await self.send(
                 message, destination=self.recipient, from_mod=True, anonymous=anonymous
             )
         except Exception:
@@ -663,6 +705,16 @@ class Thread:
                     type_="anonymous" if anonymous else "thread_message",
                 )
             )
+            tasks.append(
+                self.bot.api.add_message_link(
+                    self.channel.id,
+                    msg.id,
+                    dm_msg.id,
+                    recipient_id=self.id,
+                    author_id=message.author.id,
+                    kind="anonymous" if anonymous else "thread_message",
+                )
+            )
 
             # Cancel closing if a thread message is sent.
             if self.close_task is not None:
@@ -854,6 +906,18 @@ class Thread:
 
         msg = await destination.send(mentions, embed=embed)
 
+        if not from_mod and not note:
+            self.bot.loop.create_task(
+                self.bot.api.add_message_link(
+                    self.channel.id,
+                    msg.id,
+                    message.id,
+                    recipient_id=self.id,
+                    author_id=author.id,
+                    kind="recipient",
+                )
+            )
+
         if additional_images:
             self.ready = False
             await asyncio.gather(*additional_images)
@@ -862,15 +926,9 @@ class Thread:
         return msg
 
     def get_notifications(self) -> str:
-        key = str(self.id)
-
         mentions = []
-        mentions.extend(self.bot.config["subscriptions"].get(key, []))
-
-        if key in self.bot.config["notification_squad"]:
-            mentions.extend(self.bot.config["notification_squad"][key])
-            self.bot.config["notification_squad"].pop(key)
-            self.bot.loop.create_task(self.bot.config.update())
+        mentions.extend(self.manager.get_state(self.id)["subscriptions"])
+        mentions.extend(self.manager.pop_notifications(self.id))
 
         return " ".join(mentions)
 
@@ -880,11 +938,163 @@ class ThreadManager:
 
     def __init__(self, bot):
         self.bot = bot
+        # recipient id -> Thread
         self.cache = {}
+        # channel id -> Thread, kept in sync with `cache`
+        self.channel_cache = {}
+        # channel ids that are known not to be Modmail threads
+        self.non_thread_channels = set()
+        self._populated = False
+        # recipient id -> thread state (subscriptions, notification_squad,
+        # links_backfilled), mirror of the `thread_states` collection
+        self.states = {}
+        self._link_backfills = asyncio.Semaphore(MESSAGE_LINK_BACKFILLS)
+        bot.scheduler.register("close", self._run_closure)
+        bot.scheduler.register("auto_close", self._run_closure)
 
     async def populate_cache(self) -> None:
         for channel in self.bot.modmail_guild.text_channels:
             await self.find(channel=channel)
+        self._populated = True
+
+    async def load_states(self) -> None:
+        """Loads the thread states and moves the legacy ones out of the config."""
+        self.states = {}
+        for state in await self.bot.api.get_thread_states():
+            self.states[state["recipient_id"]] = {
+                **self._new_state(state["recipient_id"]),
+                **state,
+            }
+
+        closures = self.bot.config["closures"]
+        if closures:
+            logger.info("Sposto %d chiusure programmate nello scheduler.", len(closures))
+            for recipient_id, closure in closures.items():
+                await self._migrate_closure(int(recipient_id), closure)
+            self.bot.config.remove("closures")
+            await self.bot.config.update()
+
+        legacy = {
+            "subscriptions": self.bot.config["subscriptions"],
+            "notification_squad": self.bot.config["notification_squad"],
+        }
+        if any(legacy.values()):
+            migrated = set()
+            for field, values in legacy.items():
+                for recipient_id, value in values.items():
+                    recipient_id = int(recipient_id)
+                    self.states.setdefault(recipient_id, self._new_state(recipient_id))
+                    self.states[recipient_id][field] = value
+                    migrated.add(recipient_id)
+
+            logger.info("Sposto lo stato di %d stanze dalla configurazione.", len(migrated))
+            for recipient_id in migrated:
+                await self.bot.api.update_thread_state(
+                    recipient_id, {"$set": self.states[recipient_id]}
+                )
+            for key in ("subscriptions", "notification_squad"):
+                self.bot.config.remove(key)
+            await self.bot.config.update()
+
+        logger.debug("Caricato lo stato di %d stanze.", len(self.states))
+
+    async def _migrate_closure(self, recipient_id: int, closure: dict) -> None:
+        kind = "auto_close" if closure.get("auto_close") else "close"
+        await self.bot.scheduler.schedule(
+            kind,
+            f"{kind}:{recipient_id}",
+            datetime.fromisoformat(closure["time"]),
+            {
+                "recipient_id": recipient_id,
+                "closer_id": closure["closer_id"],
+                "silent": closure["silent"],
+                "delete_channel": closure["delete_channel"],
+                "message": closure["message"],
+            },
+        )
+
+    async def _run_closure(self, job: dict) -> None:
+        data = job["data"]
+        thread = await self.find(recipient_id=data["recipient_id"])
+        if thread is None:
+            # If the channel is deleted
+            logger.debug(
+                "Non è stato possibile chiudere la stanza per l'utente %s.", data["recipient_id"]
+            )
+            return await self.delete_state(data["recipient_id"])
+
+        if job["kind"] == "auto_close":
+            deadline = thread.auto_close_deadline()
+            if deadline is not None and deadline > datetime.utcnow():
+                # there was activity since the job was scheduled
+                await self.bot.scheduler.schedule(job["kind"], job["key"], deadline, data)
+                return
+
+        closer = self.bot.get_user(data["closer_id"]) or self.bot.user
+        await thread._close(
+            closer, data["silent"], data["delete_channel"], data["message"], scheduled=True
+        )
+
+    @staticmethod
+    def _new_state(recipient_id: int) -> dict:
+        return {
+            "recipient_id": recipient_id,
+            "subscriptions": [],
+            "notification_squad": [],
+            "links_backfilled": False,
+        }
+
+    def get_state(self, recipient_id: int) -> dict:
+        """Returns the state of a thread, it must not be modified in place."""
+        return self.states.get(recipient_id) or self._new_state(recipient_id)
+
+    def _ensure_state(self, recipient_id: int) -> dict:
+        if recipient_id not in self.states:
+            self.states[recipient_id] = self._new_state(recipient_id)
+        return self.states[recipient_id]
+
+    async def add_mention(self, recipient_id: int, field: str, mention: str) -> bool:
+        """
+        Adds a mention to the `subscriptions` or `notification_squad` of a thread.
+
+        Returns `False` if the mention was already there.
+        """
+        mentions = self._ensure_state(recipient_id)[field]
+        if mention in mentions:
+            return False
+        mentions.append(mention)
+        await self.bot.api.update_thread_state(recipient_id, {"$addToSet": {field: mention}})
+        return True
+
+    async def remove_mention(self, recipient_id: int, field: str, mention: str) -> bool:
+        """
+        Removes a mention from the `subscriptions` or `notification_squad` of a thread.
+
+        Returns `False` if the mention was not there.
+        """
+        state = self.states.get(recipient_id)
+        if state is None or mention not in state[field]:
+            return False
+        state[field].remove(mention)
+        await self.bot.api.update_thread_state(recipient_id, {"$pull": {field: mention}})
+        return True
+
+    def pop_notifications(self, recipient_id: int) -> list:
+        """Returns and clears the one-time mentions of a thread."""
+        state = self.states.get(recipient_id)
+        if state is None or not state["notification_squad"]:
+            return []
+        mentions, state["notification_squad"] = state["notification_squad"], []
+        self.bot.loop.create_task(
+            self.bot.api.update_thread_state(
+                recipient_id, {"$pull": {"notification_squad": {"$in": mentions}}}
+            )
+        )
+        return mentions
+
+    async def delete_state(self, recipient_id: int) -> None:
+        if self.states.pop(recipient_id, None) is not None:
+            await self.bot.api.delete_thread_state(recipient_id)
 
     def __len__(self):
         return len(self.cache)
@@ -895,6 +1105,56 @@ class ThreadManager:
     def __getitem__(self, item: str) -> Thread:
         return self.cache[item]
 
+    def register(self, thread: Thread) -> None:
+        """Adds a thread to both the recipient and the channel index."""
+        old = self.cache.get(thread.id)
+        if old is not None and old is not thread and old.channel is not None:
+            if self.channel_cache.get(old.channel.id) is old:
+                self.channel_cache.pop(old.channel.id)
+
+        self.cache[thread.id] = thread
+        if thread.channel is not None:
+            self.channel_cache[thread.channel.id] = thread
+            self.non_thread_channels.discard(thread.channel.id)
+
+    def unregister(self, thread: Thread) -> Thread:
+        """
+        Removes a thread from both indexes.
+
+        Raises `KeyError` if there is no thread for the recipient.
+        """
+        current = self.cache[thread.id]
+        if current is thread:
+            self.cache.pop(thread.id)
+        # otherwise a newer thread for the same recipient is already registered
+        if thread.channel is not None and self.channel_cache.get(thread.channel.id) is thread:
+            self.channel_cache.pop(thread.channel.id)
+        return thread
+
+    def channel_created(self, channel: discord.TextChannel) -> None:
+        self.non_thread_channels.discard(channel.id)
+        if channel.topic:
+            self._find_from_channel(channel)
+
+    def channel_deleted(self, channel: discord.TextChannel) -> None:
+        # The thread itself is dropped from the index when it gets closed.
+        self.non_thread_channels.discard(channel.id)
+
+    async def channel_updated(self, before: discord.TextChannel, after: discord.TextChannel):
+        if before.topic == after.topic:
+            return
+
+        thread = self.channel_cache.get(after.id)
+        if thread is not None:
+            if match_user_id(after.topic or "") != thread.id:
+                logger.debug("Ho trovato una stanza con l'ID manomesso.")
+                await after.edit(topic=f"ID utente: {thread.id}")
+            return
+
+        self.non_thread_channels.discard(after.id)
+        if self._find_from_channel(after) is None:
+            self.non_thread_channels.add(after.id)
+
     async def find(
         self,
         *,
@@ -904,14 +1164,13 @@ class ThreadManager:
     ) -> typing.Optional[Thread]:
         """Finds a thread from cache or from discord channel topics."""
         if recipient is None and channel is not None:
+            thread = self.channel_cache.get(channel.id)
+            if thread is not None or channel.id in self.non_thread_channels:
+                return thread
+
             thread = self._find_from_channel(channel)
             if thread is None:
-                user_id, thread = next(
-                    ((k, v) for k, v in self.cache.items() if v.channel == channel), (-1, None)
-                )
-                if thread is not None:
-                    logger.debug("Found thread with tempered ID.")
-                    await channel.edit(topic=f"ID utente: {user_id}")
+                self.non_thread_channels.add(channel.id)
             return thread
 
         if recipient:
@@ -928,13 +1187,15 @@ class ThreadManager:
                     thread.close(closer=self.bot.user, silent=True, delete_channel=False)
                 )
                 thread = None
-        else:
-            channel = discord.utils.get(
-                self.bot.modmail_guild.text_channels, topic=f"User ID: {recipient_id}"
+        elif not self._populated:
+            # The index is authoritative once populate_cache ran.
+            channel = discord.utils.find(
+                lambda c: c.topic and match_user_id(c.topic) == recipient_id,
+                self.bot.modmail_guild.text_channels,
             )
             if channel:
                 thread = Thread(self, recipient or recipient_id, channel)
-                self.cache[recipient_id] = thread
+                self.register(thread)
                 thread.ready = True
         return thread
 
@@ -958,9 +1219,10 @@ class ThreadManager:
 
         recipient = self.bot.get_user(user_id)
         if recipient is None:
-            self.cache[user_id] = thread = Thread(self, user_id, channel)
+            thread = Thread(self, user_id, channel)
         else:
-            self.cache[user_id] = thread = Thread(self, recipient, channel)
+            thread = Thread(self, recipient, channel)
+        self.register(thread)
         thread.ready = True
 
         return thread
@@ -990,7 +1252,7 @@ class ThreadManager:
 
         thread = Thread(self, recipient)
 
-        self.cache[recipient.id] = thread
+        self.register(thread)
 
         # Schedule thread setup for later
         cat = self.bot.main_category
@@ -1009,5 +1271,31 @@ class ThreadManager:
         self.bot.loop.create_task(thread.setup(creator=creator, category=category))
         return thread
 
+    async def backfill_message_links(self, channel_id: typing.Union[int, str]) -> None:
+        """Rebuilds the message links of an open log, once per thread."""
+        channel = self.bot.get_channel(int(channel_id))
+        if channel is None:
+            return
+        thread = await self.find(channel=channel)
+        if thread is None or thread.recipient is None:
+            return
+        if self.get_state(thread.id)["links_backfilled"]:
+            return
+        if not await self.bot.api.has_message_links(channel.id):
+            async with self._link_backfills:
+                try:
+                    count = await thread.backfill_message_links()
+                except discord.HTTPException:
+                    logger.warning(
+                        "Non è stato possibile ricostruire i link di %s.", thread, exc_info=True
+                    )
+                    return
+            logger.debug("Ricostruiti %d link per la stanza %s.", count, thread)
+
+        if self.cache.get(thread.id) is thread:
+            # the state is deleted with the thread, the next one stores its links
+            self._ensure_state(thread.id)["links_backfilled"] = True
+            await self.bot.api.update_thread_state(thread.id, {"$set": {"links_backfilled": True}})
+
     async def find_or_create(self, recipient) -> Thread:
         return await self.find(recipient=recipient) or await self.create(recipient)
@@ -3,12 +3,14 @@ import functools
 import re
 import string
 import typing
+from datetime import datetime
 from difflib import get_close_matches
 from distutils.util import strtobool as _stb  # pylint: disable=import-error
 from itertools import takewhile, zip_longest
 from urllib import parse
 
 import discord
+from dateutil import parser
 from discord.ext import commands
 
 __all__ = [
@@ -29,6 +31,7 @@ __all__ = [
     "trigger_typing",
     "escape_code_block",
     "format_channel_name",
+    "parse_timestamp",
 ]
 
 
@@ -317,3 +320,24 @@ def format_channel_name(author, guild, exclude_channel=None):
         counter += 1
 
     return new_name
+
+
+def parse_timestamp(value: typing.Union[str, datetime, None]) -> typing.Optional[datetime]:
+    """
+    Returns a timestamp of a log as a datetime.
+
+    Logs store them as datetimes, older ones as strings.
+
+    Parameters
+    ----------
+    value : Union[str, datetime, None]
+        The stored timestamp.
+
+    Returns
+    -------
+    Optional[datetime]
+        The timestamp, `None` if it was `None`.
+    """
+    if value is None or isinstance(value, datetime):
+        return value
+    return parser.parse(value)